@@ -14,7 +14,7 @@ import signal
 import sys
 import traceback
 import types
-from collections import OrderedDict
+from collections import Counter, OrderedDict
 from inspect import signature
 import io
 from io import StringIO
@@ -32,10 +32,22 @@ import objprint
 import stat
 import socketserver
 import json
-import warnings
+import itertools
+import queue
+import reprlib
+import struct
+import fnmatch
+import weakref
+import hashlib
+import functools
+import tokenize
+import bisect
+import pickle
+import base64
+import zlib
 
 # To ensure the Python readline hook go first
-import readline  
+import readline as _readline  # noqa: F401
 if not os.environ.get("_PDB_W_MT", ""):
     import csrc._rl_patch as _rl_patch
 else:
@@ -102,6 +114,7 @@ side_effects_free = re.compile(r"^ *[_0-9a-zA-Z\[\].]* *$")
 _pdb_lock = threading.Lock()
 _readline_lock = threading.Lock()
 _inject_lock = threading.Lock()
+_interacting = threading.local()
 _ipython_enabled = False
 _ipython_nested = False
 _ipython_cfg = None
@@ -140,14 +153,15 @@ def is_char_wide(char):
     return sc
 
 
+_wide_chars = re.compile("[\u4e00-\u9fff\u3040-\u30ff\uac00-\ud7a3\uff01-\uff60]")
+
+
 def get_width(line):
     # Return the true width of the line. Not the same as line length.
     # Chinese/Japanese/Korean characters take up two spaces of width.
-    line_length = len(line)
-    for char in line:
-        if is_char_wide(char):
-            line_length += 1
-    return line_length
+    if line.isascii():
+        return len(line)
+    return len(line) + len(_wide_chars.findall(line))
 
 
 def set_line_width(line, width, tll=True):
@@ -161,6 +175,8 @@ def set_line_width(line, width, tll=True):
         return line
     elif line_width < width:
         new_line = line
+    elif line.isascii():
+        new_line = line[:width]
     else:
         for char in line:
             updated_line = "%s%s" % (new_line, char)
@@ -182,6 +198,7 @@ class DefaultConfig(object):
     sticky_by_default = False
     bg = "dark"
     use_pygments = True
+    highlighter = "pygments"  # Or "tokenize", same style, no Pygments lexer
     colorscheme = None
     style = DesertStyle
     use_terminal256formatter = True  # Defaults to `"256color" in $TERM`.
@@ -227,6 +244,25 @@ class DefaultConfig(object):
     serve_address = "localhost"
     serve_port = 0 
     serve_max_retry = 10
+    serve_mode = "thread"  # Or "asyncio" to serve all clients from one event loop
+    dap_port = None  # Serve the Debug Adapter Protocol here, not a PTY
+    display_fingerprints = {}  # type --> callable(value) returning a cheap change key for `display`
+    display_sample_size = 8  # Elements of a container compared by `display`
+    sticky_show_changed_locals = False  # List the locals rebound since the last stop
+    changed_locals_max_scan = 500  # Locals of a frame compared at most
+    changed_locals_repr_limit = 60  # Characters shown per changed value
+    where_page_size = 40  # Entries shown per `where` page, 0 to show all
+    where_collapse_threshold = 0  # Collapse longer runs of one recursive function, 0 never
+    buffer_output = True  # Write the output of each prompt cycle with a single write
+    snapshot_source_context = 20  # Source lines kept around module frames
+    snapshot_pickle_limit = 1 << 16  # Larger locals keep a repr; 0: never
+    until_fast_forward = True  # Run `until` without tracing the frame's lines (3.12+)
+    profile_sample_rate = 200  # Stack samples per second taken by `profile`
+    profile_top = 15  # Lines and functions listed by `profile`
+    memdiff_top = 10  # Allocation sites listed by `memdiff`
+    skip_asyncio_internals = True  # Never step into event-loop frames; follow the task
+    just_my_code = False  # Never stop outside of user code (see `user_source_roots`)
+    user_source_roots = ()  # Directories of user code; default: all but stdlib/site-packages
 
     def setup(self, pdb):
         pass
@@ -238,8 +274,12 @@ class DefaultConfig(object):
 def setbgcolor(line, color):
     # Add a bgcolor attribute to all escape sequences found.
     setbg = "\x1b[%sm" % color
-    regexbg = "\\1;%sm" % color
-    result = setbg + re.sub("(\x1b\\[.*?)m", regexbg, line) + "\x1b[00m"
+    # Same as re.sub("(\x1b\\[.*?)m", "\\1;<color>m", line), without a regex
+    suffix = ";%sm" % color
+    head, *escapes = line.split("\x1b[")
+    result = setbg + "\x1b[".join(
+        [head] + [escape.replace("m", suffix, 1) for escape in escapes]
+    ) + "\x1b[00m"
     if os.environ.get("TERM") == "eterm-color":
         result = result.replace(setbg, "\x1b[37;%dm" % color)
         result = result.replace("\x1b[00;%dm" % color, "\x1b[37;%dm" % color)
@@ -250,14 +290,465 @@ def setbgcolor(line, color):
 CLEARSCREEN = "\033[2J\033[1;1H"
 
 
+@functools.lru_cache(maxsize=64)
+def _color_prefix(color):
+    """Escape sequence opening `color`, as used by `Color.set`."""
+    return "\x1b[%sm" % getattr(Color, color, color)
+
+
+@functools.lru_cache(maxsize=16)
+def _listing_lineno_re(str_code):
+    # Line numbers that Pygments colored like strings in a `list` output
+    return re.compile(
+        rf"(\x1b\[38;5;15m[ ]+\x1b\[39m\x1b\[)?{str_code}(m\d+\x1b\[39m.*\n)"
+        rf"|(\x1b\[){str_code}(m[ ]*\d+)(.*\x1b\[39m\n)"
+    )
+
+
+class _CycleBuffer:
+    """Collect the output of one prompt cycle and write it at once.
+
+    Installed over `Pdb.stdout` during `interaction`; flushed before
+    input is read, before the fd is handed out and when leaving.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.parts = []
+
+    def write(self, s):
+        self.parts.append(s)
+        return len(s)
+
+    def writelines(self, lines):
+        self.parts.extend(lines)
+
+    def flush(self):
+        if self.parts:
+            data = "".join(self.parts)
+            self.parts.clear()
+            self.stream.write(data)
+        self.stream.flush()
+
+    def fileno(self):
+        self.flush()
+        return self.stream.fileno()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class _TokenHighlighter:
+    """Python highlighter built on `tokenize`.
+
+    The escape sequences of each token kind are taken once from a Pygments
+    formatter, so the output matches the configured style; highlighting
+    itself is one tokenizer pass without any lexer machinery.
+    """
+
+    def __init__(self, formatter):
+        import builtins
+        import keyword
+        from pygments.token import Token
+        kinds = {
+            "keyword": Token.Keyword,
+            "constant": Token.Keyword.Constant,
+            "namespace": Token.Keyword.Namespace,
+            "name": Token.Name,
+            "builtin": Token.Name.Builtin,
+            "pseudo": Token.Name.Builtin.Pseudo,
+            "exception": Token.Name.Exception,
+            "function": Token.Name.Function,
+            "class": Token.Name.Class,
+            "decorator": Token.Name.Decorator,
+            "string": Token.Literal.String,
+            "number": Token.Literal.Number,
+            "comment": Token.Comment.Single,
+            "operator": Token.Operator,
+            "punctuation": Token.Punctuation,
+        }
+        self.table = {}
+        for kind, ttype in kinds.items():
+            out = StringIO()
+            formatter.format([(ttype, "\0")], out)
+            start, _, end = out.getvalue().partition("\0")
+            if start or end:
+                self.table[kind] = start, end
+        self.names = {}
+        for name in keyword.kwlist:
+            self.names[name] = "keyword"
+        for name in ("True", "False", "None"):
+            self.names[name] = "constant"
+        for name in ("import", "from"):
+            self.names[name] = "namespace"
+        for name, obj in vars(builtins).items():
+            if name.startswith("_"):
+                continue
+            if isinstance(obj, type) and issubclass(obj, BaseException):
+                self.names[name] = "exception"
+            else:
+                self.names[name] = "builtin"
+        for name in ("self", "cls"):
+            self.names[name] = "pseudo"
+
+    def _kind(self, tok, previous):
+        ttype = tok.type
+        if ttype == tokenize.NAME:
+            if previous == "def":
+                return "function"
+            if previous == "class":
+                return "class"
+            if previous == "@":
+                return "decorator"
+            return self.names.get(tok.string, "name")
+        if ttype == tokenize.OP:
+            return "punctuation" if tok.string in "()[]{},;:." else "operator"
+        if (ttype == tokenize.STRING
+                or tokenize.tok_name[ttype].startswith("FSTRING")):
+            return "string"
+        if ttype == tokenize.NUMBER:
+            return "number"
+        if ttype == tokenize.COMMENT:
+            return "comment"
+        return None
+
+    def highlight(self, src):
+        if not src.endswith("\n"):
+            src += "\n"
+        lines = src.splitlines(True)
+        # Listings start anywhere in a block: tokenize dedented lines and
+        # map the positions back, so indentation never trips the tokenizer.
+        offsets = []
+        stripped = []
+        pos = 0
+        for line in lines:
+            body = line.lstrip(" \t")
+            offsets.append(pos + len(line) - len(body))
+            stripped.append(body)
+            pos += len(line)
+        out = []
+        done = 0
+        row = 0
+        while row < len(lines):
+            read_line = StringIO("".join(stripped[row:])).readline
+            last_row = row
+            previous = None
+            try:
+                for tok in tokenize.generate_tokens(read_line):
+                    kind = self._kind(tok, previous)
+                    if tok.type in (tokenize.NAME, tokenize.OP):
+                        previous = tok.string
+                    (srow, scol), (erow, ecol) = tok.start, tok.end
+                    last_row = row + erow
+                    if kind not in self.table:
+                        continue
+                    start = offsets[row + srow - 1] + scol
+                    end = offsets[row + erow - 1] + ecol
+                    if start < done:
+                        continue
+                    on, off = self.table[kind]
+                    out.append(src[done:start])
+                    out.append("\n".join(
+                        on + part + off if part else part
+                        for part in src[start:end].split("\n")
+                    ))
+                    done = end
+                break
+            except (tokenize.TokenError, SyntaxError):
+                # Resume after the offending part, leaving it uncolored
+                row = max(last_row, row + 1)
+        out.append(src[done:])
+        return "".join(out)
+
+
+class _CodeCache:
+    """Mapping keyed by code object identity; entries go with the code.
+
+    A WeakKeyDictionary would hash and compare code objects by value,
+    which costs as much as the code is long.
+    """
+
+    def __init__(self):
+        self._data = {}  # id(code) --> (weakref to code, value)
+
+    def __getitem__(self, code):
+        entry = self._data.get(id(code))
+        if entry is None or entry[0]() is not code:
+            raise KeyError(code)
+        return entry[1]
+
+    def __setitem__(self, code, value):
+        data = self._data
+        key = id(code)
+
+        def _drop(ref):
+            if data.get(key, (None,))[0] is ref:
+                del data[key]
+
+        data[key] = weakref.ref(code, _drop), value
+
+    def __contains__(self, code):
+        entry = self._data.get(id(code))
+        return entry is not None and entry[0]() is code
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, code, default=None):
+        try:
+            return self[code]
+        except KeyError:
+            return default
+
+    def setdefault(self, code, default=None):
+        try:
+            return self[code]
+        except KeyError:
+            self[code] = default
+            return default
+
+
+_linestarts_cache = _CodeCache()  # code --> (offsets, linenos)
+
+
 def lasti2lineno(code, lasti):
-    import dis
-    linestarts = list(dis.findlinestarts(code))
-    linestarts.reverse()
-    for i, lineno in linestarts:
-        if lasti >= i:
-            return lineno
-    return 0
+    try:
+        offsets, linenos = _linestarts_cache[code]
+    except KeyError:
+        import dis
+        starts = [(i, lineno) for i, lineno in dis.findlinestarts(code) if lineno is not None]
+        offsets = [i for i, _ in starts]
+        linenos = [lineno for _, lineno in starts]
+        _linestarts_cache[code] = offsets, linenos
+    # The last line starting at or before `lasti`
+    index = bisect.bisect_right(offsets, lasti) - 1
+    return linenos[index] if index >= 0 else 0
+
+
+# Top-level packages whose frames are event-loop machinery, not user code
+_ASYNCIO_INTERNALS = frozenset(("asyncio", "selectors", "uvloop"))
+
+
+def _running_loop():
+    """The event loop running in this thread, without importing asyncio."""
+    asyncio = sys.modules.get("asyncio")
+    if asyncio is None:
+        return None
+    return asyncio._get_running_loop()
+
+
+def _format_size(size, sign=False):
+    """`size` bytes as B/KiB/MiB/GiB, with a + for growth if `sign`."""
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            break
+        size /= 1024
+    else:
+        unit = "GiB"
+    if unit == "B":
+        return ("%+d B" if sign else "%d B") % size
+    return ("%+.1f %s" if sign else "%.1f %s") % (size, unit)
+
+
+def _task_sort_key(task):
+    # "Task-2" before "Task-10"
+    name = task.get_name()
+    return len(name), name
+
+
+@functools.lru_cache(maxsize=32)
+def _skip_regex(patterns):
+    """One regex matching any of the fnmatch `patterns` (a frozenset)."""
+    return re.compile("|".join(fnmatch.translate(p) for p in sorted(patterns)))
+
+
+@functools.lru_cache(maxsize=1)
+def _library_roots():
+    """Directory prefixes of the stdlib and of installed packages."""
+    import sysconfig
+    roots = set()
+    paths = sysconfig.get_paths()
+    for name in ("stdlib", "platstdlib", "purelib", "platlib"):
+        path = paths.get(name)
+        if path:
+            roots.add(os.path.join(os.path.abspath(path), ""))
+            roots.add(os.path.join(os.path.realpath(path), ""))
+    return tuple(sorted(roots))
+
+
+_library_code_cache = _CodeCache()  # code --> bool
+
+
+def _is_library_file(filename):
+    """Whether `filename` is in the stdlib or in an installed package."""
+    path = os.path.abspath(filename)
+    return path.startswith(_library_roots()) or any(
+        part in ("site-packages", "dist-packages") for part in path.split(os.sep)
+    )
+
+
+def _is_library_code(code, module_globals):
+    """Whether `code` comes from the stdlib, site-packages or a frozen module.
+
+    Generated code ("<string>") goes with the file of its globals; without
+    one, only `__main__` (python -c, stdin) is user code.
+    """
+    try:
+        return _library_code_cache[code]
+    except KeyError:
+        pass
+    filename = code.co_filename
+    if not filename.startswith("<"):
+        library = _is_library_file(filename)
+    elif filename.startswith("<frozen "):
+        library = True
+    elif module_globals.get("__file__"):
+        library = _is_library_file(module_globals["__file__"])
+    else:
+        library = module_globals.get("__name__") != "__main__"
+    _library_code_cache[code] = library
+    return library
+
+
+class _Profile:
+    """Samples of all thread stacks, taken by the `profile` command.
+
+    Runs in its own thread and reads `sys._current_frames()`, so the
+    program is not traced. `on_done` stops the debugged thread when the
+    time is up, unless a stop of the debugger ended the profile first.
+    """
+
+    def __init__(self, duration, interval, output=None):
+        self.duration = duration
+        self.interval = interval
+        self.output = output
+        self.lines = Counter()  # (code, lineno) --> samples at the top
+        self.stacks = Counter()  # (thread name, codes from the root) --> samples
+        self.samples = 0
+        self.elapsed = 0.0
+        self.on_done = None
+        self.running = True
+        self.closed = False  # set once the debugger has stopped again
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, name="pdbp-profile", daemon=True
+        )
+
+    def _run(self):
+        me = threading.get_ident()
+        # The sampler only runs when it gets the GIL. With the default 5ms
+        # switch interval, a busy thread that sleeps every few ms would
+        # only ever be seen sleeping.
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(switch_interval, self.interval / 10))
+        start = time.perf_counter()
+        deadline = start + self.duration
+        try:
+            while not self._stopped.wait(self.interval):
+                if time.perf_counter() >= deadline:
+                    break
+                self._sample(me)
+        finally:
+            sys.setswitchinterval(switch_interval)
+        self.elapsed = time.perf_counter() - start
+        if self.stop() and self.on_done is not None:
+            self.on_done()
+
+    def _sample(self, me):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            self.lines[frame.f_code, frame.f_lineno] += 1
+            codes = []
+            while frame is not None:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            codes.reverse()
+            self.stacks[names.get(ident, str(ident)), tuple(codes)] += 1
+        self.samples += 1
+
+    def stop(self):
+        """End sampling; return whether it was still running."""
+        with self._lock:
+            running, self.running = self.running, False
+        self._stopped.set()
+        return running
+
+    def functions(self):
+        """Return code object --> [samples at the top, samples anywhere]."""
+        result = {}
+        for (co, _), count in self.lines.items():
+            result.setdefault(co, [0, 0])[0] += count
+        for (_, codes), count in self.stacks.items():
+            for co in set(codes):
+                result.setdefault(co, [0, 0])[1] += count
+        return result
+
+
+class _UntilMonitor:
+    """Run `until` in one frame on sys.monitoring LINE events (3.12+).
+
+    Line tracing is turned off for the frame. Lines before the target
+    answer DISABLE, so a loop body runs untraced after its first pass.
+    Calls and returns are still traced as usual.
+    """
+
+    active = None  # sys.monitoring is process-wide: one frame at a time
+
+    def __init__(self, pdb, frame, lineno):
+        self.pdb = pdb
+        self.frame = frame
+        self.code = frame.f_code
+        self.lineno = lineno
+
+    @classmethod
+    def arm(cls, pdb, frame, lineno):
+        monitoring = getattr(sys, "monitoring", None)
+        if monitoring is None or cls.active is not None:
+            return None
+        try:
+            monitoring.use_tool_id(monitoring.DEBUGGER_ID, "pdbp")
+        except ValueError:
+            return None
+        self = cls(pdb, frame, lineno)
+        cls.active = self
+        monitoring.register_callback(
+            monitoring.DEBUGGER_ID, monitoring.events.LINE, self._line
+        )
+        # Clearing this code's events re-enables the lines an earlier
+        # `until` disabled, without touching other tools
+        monitoring.set_local_events(monitoring.DEBUGGER_ID, self.code, 0)
+        monitoring.set_local_events(
+            monitoring.DEBUGGER_ID, self.code, monitoring.events.LINE
+        )
+        frame.f_trace_lines = False
+        return self
+
+    def disarm(self):
+        if _UntilMonitor.active is not self:
+            return
+        _UntilMonitor.active = None
+        monitoring = sys.monitoring
+        monitoring.set_local_events(monitoring.DEBUGGER_ID, self.code, 0)
+        monitoring.register_callback(
+            monitoring.DEBUGGER_ID, monitoring.events.LINE, None
+        )
+        monitoring.free_tool_id(monitoring.DEBUGGER_ID)
+        self.frame.f_trace_lines = True
+        self.frame = None
+
+    def _line(self, code, line):
+        if line < self.lineno:
+            return sys.monitoring.DISABLE
+        frame = sys._getframe(1)
+        if frame is not self.frame:
+            return None
+        # The settrace line event of this line was already suppressed
+        self.disarm()
+        self.pdb.trace_dispatch(frame, "line", None)
+        return None
 
 
 class PtyFetchError(RuntimeError): 
@@ -275,16 +766,88 @@ class Undefined:
 
 undefined = Undefined()
 
+_SCALAR_TYPES = (int, float, complex, bool, type(None), Undefined)
+
+
+def _shallow_key(value):
+    # Scalars compare by value, everything else by identity
+    if type(value) in _SCALAR_TYPES:
+        return value
+    if type(value) in (str, bytes) and len(value) <= 64:
+        return value
+    return type(value), id(value)
+
+
+def _fingerprint(value, config):
+    """Return a cheap key that changes when `value` visibly changes.
+
+    Buffers hash their bytes; sequences, mappings and sets sample a
+    bounded number of elements, and `config.display_fingerprints` can
+    override this per type. Those keys leave out the object's identity,
+    so an equal copy does not count as a change. No reference to `value`
+    is kept.
+    """
+    custom = config.display_fingerprints
+    if custom:
+        for klass in type(value).__mro__:
+            if klass in custom:
+                return klass, custom[klass](value)
+    cls = type(value)
+    if cls in _SCALAR_TYPES:
+        return value
+    if cls is str:
+        return cls, len(value), hash(value)
+    if isinstance(value, (list, tuple, dict, set, frozenset)):
+        size = len(value)
+        sample = config.display_sample_size
+        if isinstance(value, dict):
+            items = value.items()
+            if size > sample:
+                items = itertools.islice(items, sample)
+            keys = tuple((_shallow_key(k), _shallow_key(v)) for k, v in items)
+        elif isinstance(value, (set, frozenset)):
+            # Sorted by hash, equal sets iterate in different orders
+            items = value
+            if size > sample:
+                items = itertools.islice(value, sample)
+            keys = tuple(_shallow_key(e) for e in sorted(items, key=hash))
+        else:
+            step = max(size // sample, 1)
+            keys = tuple(
+                _shallow_key(value[i])
+                for i in range(0, size, step)[:sample]
+            )
+            if size:
+                keys += (_shallow_key(value[-1]),)
+        return cls, size, keys
+    try:
+        view = memoryview(value)
+    except TypeError:
+        return cls, id(value)
+    with view:
+        data = view if view.c_contiguous else view.tobytes()
+        digest = hashlib.blake2b(data).digest()
+        return cls, view.format, view.shape, digest
+
 
 _inject = {}
 exec(
     compile(
         """
-def _inject_wrapper(fn):
+def _inject_wrapper(fn, hook):
     from functools import wraps
     @wraps(fn)
     def new_fn(*args, **kwargs):
-        import pdbp; pdbp.set_trace()
+        if hook.armed:
+            hook.calls += 1
+            if (
+                not hook.calls % hook.every
+                and (hook.condition is None or hook.condition(*args, **kwargs))
+            ):
+                hook.hits += 1
+                if hook.hits == hook.max_hits:
+                    hook.armed = False
+                import pdbp; pdbp.set_trace()
         return fn(*args, **kwargs)
     return new_fn
         """,
@@ -299,7 +862,8 @@ _inject_id =  0
 
 
 class _InjectHandle:
-    def __init__(self, context, clb: str, _id: int):
+    def __init__(self, context, clb: str, _id: int, condition=None, every=1,
+                 max_hits=None, verbose=True):
         if not hasattr(context, clb):
             print(f"Attribute {clb} not found in {context}, nothing happens")
             return
@@ -308,41 +872,224 @@ class _InjectHandle:
         self.clb_name = clb
         self.old_clb = clb_ins
         self.id = _id
-        setattr(self.context, clb, _inject(clb_ins))
+        self.condition = condition
+        self.every = max(int(every), 1)
+        self.max_hits = max_hits
+        self.calls = self.hits = 0
+        self.armed = max_hits is None or max_hits > 0
+        self.new_clb = _inject(clb_ins, self)
+        self.new_clb._pdbp_inject = _id
+        setattr(self.context, clb, self.new_clb)
         _inject_handles[self.id] = self
-        print(f"<No.{_id}> Register debug hook for {clb} in {context}")
+        if verbose:
+            print(f"<No.{_id}> Register debug hook for {clb} in {context}")
 
-    def remove(self):
+    def remove(self, verbose=True):
         setattr(self.context, self.clb_name, self.old_clb)
         _inject_handles.pop(self.id)
-        print(f"<No.{self.id}> Detach debug hook for {self.clb_name} in {self.context}")
+        if verbose:
+            print(f"<No.{self.id}> Detach debug hook for {self.clb_name}"
+                  f" in {self.context}")
+
+    def enable(self):
+        # Also restarts the hit count of a hook that ran out of hits
+        self.calls = self.hits = 0
+        self.armed = self.max_hits is None or self.max_hits > 0
+        setattr(self.context, self.clb_name, self.new_clb)
+
+    def disable(self):
+        # The original callable is put back, so a disabled hook costs nothing
+        self.armed = False
+        setattr(self.context, self.clb_name, self.old_clb)
 
     def __repr__(self):
         context_name = getattr(self.context, "__name__", "<no name>")
-        return f"{context_name}.{self.clb_name}"
+        state = "" if self.armed else ", disabled"
+        return f"{context_name}.{self.clb_name} (hits: {self.hits}{state})"
 
 
-def inject_debug(context, clb):
-    _inject_lock.acquire()
+def inject_debug(context, clb, condition=None, every=1, max_hits=None):
+    """Stop in the debugger when `context.clb` is called.
+
+    Only every `every`-th call is considered, and of those only the ones
+    where `condition(*args, **kwargs)` is true. The hook disarms itself
+    after `max_hits` stops. Returns the hook number.
+    """
     global _inject_id
-    hook = _InjectHandle(context, clb, _inject_id)
-    _inject_id += 1
-    _inject_lock.release()
+    with _inject_lock:
+        hook = _InjectHandle(
+            context, clb, _inject_id, condition, every, max_hits
+        )
+        _inject_id += 1
+    return getattr(hook, "id", None)
 
 
 def remove_debug(id_num):
-    _inject_lock.acquire()
-    if id_num not in _inject_handles:
-        print(f"The hook <No.{id_num}> does not exist, use `pdbp.show_debug()` to get available numbers")
-        return
-    _inject_handles[id_num].remove()
-    _inject_lock.release()
+    with _inject_lock:
+        if id_num not in _inject_handles:
+            print(f"The hook <No.{id_num}> does not exist, use"
+                  " `pdbp.show_debug()` to get available numbers")
+            return
+        _inject_handles[id_num].remove()
+
+
+def enable_debug(id_num):
+    with _inject_lock:
+        if id_num not in _inject_handles:
+            print(f"The hook <No.{id_num}> does not exist, use"
+                  " `pdbp.show_debug()` to get available numbers")
+            return
+        _inject_handles[id_num].enable()
+
+
+def disable_debug(id_num):
+    with _inject_lock:
+        if id_num not in _inject_handles:
+            print(f"The hook <No.{id_num}> does not exist, use"
+                  " `pdbp.show_debug()` to get available numbers")
+            return
+        _inject_handles[id_num].disable()
 
 
 def show_debug():
-    _inject_lock.acquire()
-    pprint.pp(_inject_handles)
-    _inject_lock.release()
+    with _inject_lock:
+        pprint.pp(_inject_handles)
+        if _inject_patterns:
+            pprint.pp(_inject_patterns)
+
+
+class _InjectPattern:
+    def __init__(self, module_pattern, attr_pattern, _id, **hook_kwds):
+        self.module_pattern = module_pattern
+        self.attr_pattern = attr_pattern
+        self.module_re = re.compile(fnmatch.translate(module_pattern))
+        self.attr_re = re.compile(fnmatch.translate(attr_pattern))
+        self.id = _id
+        self.hook_kwds = hook_kwds
+        self.hook_ids = []
+
+    def targets(self, module):
+        """Yield (context, name) of the matching callables of `module`."""
+        mod_name = module.__name__
+        for name, obj in list(vars(module).items()):
+            if getattr(obj, "__module__", None) != mod_name:
+                continue
+            if isinstance(obj, types.FunctionType):
+                if (self.attr_re.match(name)
+                        and not hasattr(obj, "_pdbp_inject")):
+                    yield module, name
+            elif isinstance(obj, type):
+                for attr, member in list(vars(obj).items()):
+                    if (
+                        isinstance(member, types.FunctionType)
+                        and self.attr_re.match(attr)
+                        and not hasattr(member, "_pdbp_inject")
+                    ):
+                        yield obj, attr
+
+    def apply(self, module):
+        # Called with `_inject_lock` held
+        global _inject_id
+        for context, name in list(self.targets(module)):
+            _InjectHandle(
+                context, name, _inject_id, verbose=False, **self.hook_kwds
+            )
+            self.hook_ids.append(_inject_id)
+            _inject_id += 1
+
+    def __repr__(self):
+        return (f"<Pattern {self.id}> {self.module_pattern}:"
+                f"{self.attr_pattern} ({len(self.hook_ids)} hooks)")
+
+
+class _InjectLoader:
+    # Delegates to the real loader, then hooks the freshly executed module
+    def __init__(self, loader, patterns):
+        self._loader = loader
+        self._patterns = patterns
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._loader.exec_module(module)
+        with _inject_lock:
+            for pattern in self._patterns:
+                if pattern.id in _inject_patterns:
+                    pattern.apply(module)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class _InjectFinder:
+    """Meta path finder applying injection patterns to new imports."""
+
+    @classmethod
+    def find_spec(cls, fullname, path=None, target=None):
+        with _inject_lock:
+            patterns = [
+                p for p in _inject_patterns.values()
+                if p.module_re.match(fullname)
+            ]
+        if not patterns:
+            return None
+        for finder in sys.meta_path:
+            if finder is cls or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                loader = spec.loader
+                if loader is not None and hasattr(loader, "exec_module"):
+                    spec.loader = _InjectLoader(spec.loader, patterns)
+                return spec
+        return None
+
+
+def inject_debug_pattern(module_pattern, attr_pattern, condition=None,
+                         every=1, max_hits=None):
+    """Hook every matching function and method in matching modules.
+
+    Both patterns are shell-style globs, e.g. `("mypkg.*", "handle_*")`.
+    Loaded modules are indexed once and hooked under a single lock, and
+    modules imported later are hooked as they load. Returns the pattern
+    number for `remove_debug_pattern`.
+    """
+    global _inject_pattern_id
+    with _inject_lock:
+        pattern = _InjectPattern(
+            module_pattern, attr_pattern, _inject_pattern_id,
+            condition=condition, every=every, max_hits=max_hits,
+        )
+        _inject_pattern_id += 1
+        for mod_name, module in list(sys.modules.items()):
+            if (module is not None and mod_name != __name__
+                    and pattern.module_re.match(mod_name)):
+                pattern.apply(module)
+        _inject_patterns[pattern.id] = pattern
+        if _InjectFinder not in sys.meta_path:
+            sys.meta_path.insert(0, _InjectFinder)
+    print(f"{pattern!r} registered")
+    return pattern.id
+
+
+def remove_debug_pattern(id_num):
+    with _inject_lock:
+        pattern = _inject_patterns.pop(id_num, None)
+        if pattern is None:
+            print(f"The pattern <Pattern {id_num}> does not exist, use"
+                  " `pdbp.show_debug()` to get available numbers")
+            return
+        for hook_id in pattern.hook_ids:
+            if hook_id in _inject_handles:
+                _inject_handles[hook_id].remove(verbose=False)
+        if not _inject_patterns and _InjectFinder in sys.meta_path:
+            sys.meta_path.remove(_InjectFinder)
+    print(f"{pattern!r} removed")
+
+
+_inject_patterns = {}
+_inject_pattern_id = 0
 
 
 def _new_thread_run(self):
@@ -372,68 +1119,833 @@ def _new_thread_run(self):
 
     return rt
 
-class _VimRequestDispatchMixIn: pass
 
-class _VimRequestHandler(_VimRequestDispatchMixIn socketserver.BaseRequestHandler):
+_FRAME_HEADER = struct.Struct("!I")
+_FRAME_MAX_SIZE = 1 << 26
+_remote_repr = reprlib.Repr()
+_remote_repr.maxstring = _remote_repr.maxother = 256
+
+
+def _encode_frame(obj):
+    data = json.dumps(obj).encode("utf-8")
+    return _FRAME_HEADER.pack(len(data)) + data
+
+
+def _send_frame(wfile, obj):
+    wfile.write(_encode_frame(obj))
+
+
+def _recv_frame(rfile):
+    """Read one length-prefixed JSON message, None at EOF."""
+    header = rfile.read(_FRAME_HEADER.size)
+    if len(header) < _FRAME_HEADER.size:
+        return None
+    size, = _FRAME_HEADER.unpack(header)
+    if size > _FRAME_MAX_SIZE:
+        raise ValueError(f"Frame of {size} bytes exceeds the limit")
+    data = rfile.read(size)
+    if len(data) < size:
+        return None
+    return json.loads(data)
+
+
+class _VimRequestDispatchMixIn:
+    """Answer `[id, method, params]` requests with `[id, result]`.
+
+    Errors are reported as `[id, {"error": message}]`, and id 0 is kept
+    for events pushed by the server. Stack, locals and source are served
+    from the snapshot a stopped session published.
+    """
+
+    def dispatch(self, request):
+        try:
+            msg_id, method, *params = request
+            handler = getattr(self, "dispatch_" + method, None)
+        except (TypeError, ValueError):
+            return [None, {"error": f"Malformed request: {request!r}"}]
+        if handler is None:
+            return [msg_id, {"error": f"Unknown method: {method!r}"}]
+        try:
+            return [msg_id, handler(**(params[0] if params else {}))]
+        except Exception as e:
+            return [msg_id, {"error": f"{type(e).__name__}: {e}"}]
+
+    def dispatch_attach(self, tty, thread=None):
+        return _assign_remote_pty(tty, thread)
+
+    def dispatch_sessions(self):
+        with _vim_server_lock:
+            return [
+                {"thread": s.thread_id, "waiting": s.waiting, "stopped": s.stack is not None}
+                for s in _vim_sessions.values()
+            ]
+
+    def dispatch_stack(self, thread=None):
+        session = _stopped_session(thread)
+        stack, curindex = session.stack, session.curindex
+        return {
+            "thread": session.thread_id,
+            "current": curindex,
+            "frames": [
+                {
+                    "filename": frame.f_code.co_filename,
+                    "lineno": lineno,
+                    "function": frame.f_code.co_name,
+                }
+                for frame, lineno in stack
+            ],
+        }
+
+    def dispatch_locals(self, thread=None, frame=None):
+        session = _stopped_session(thread)
+        return session.locals[session.curindex if frame is None else frame]
+
+    def dispatch_source(self, thread=None, frame=None):
+        import linecache
+        f = _session_frame(_stopped_session(thread), frame)
+        filename = f.f_code.co_filename
+        return {
+            "filename": filename,
+            "lineno": f.f_lineno,
+            "lines": linecache.getlines(filename, f.f_globals),
+        }
+
+    def dispatch_resize(self, columns, lines, thread=None):
+        size = os.terminal_size((int(columns), int(lines)))
+        with _vim_server_lock:
+            if thread is None:
+                sessions = list(_vim_sessions.values())
+            elif thread in _vim_sessions:
+                sessions = [_vim_sessions[thread]]
+            else:
+                raise LookupError(f"No debugger session for thread {thread}")
+            for session in sessions:
+                session.term_size = size
+        return len(sessions)
+
+
+class _VimRequestHandler(_VimRequestDispatchMixIn, socketserver.StreamRequestHandler):
     def setup(self):
-        if _active_connection['socket']:
-            warnings.warn("A new connection is refused due to the survival of an existing connection", RuntimeWarning)
-            self.request.close()  
-            return
-        _active_connection['socket'] = self.request
+        super().setup()
+        self._write_lock = threading.Lock()
+        with _vim_server_lock:
+            _active_connections.add(self)
+
+    def send(self, obj):
+        with self._write_lock:
+            _send_frame(self.wfile, obj)
 
     def handle(self):
+        # Requests may be pipelined, every response carries its request id
         while True:
             try:
-                data = self.request.recv(4096).decode('utf-8')
-            except socket.error:
+                request = _recv_frame(self.rfile)
+            except (ValueError, OSError):
                 break
-            if data == '':
+            if request is None:
                 break
             try:
-                decoded = json.loads(data)
-            except ValueError:
-                continue
-            assert decoded[0] >= 0
-            if self._istty(decoded[1]):
-                _ext_pty = decoded[1]
-                self.request.sendall(json.dumps([decoded[0], "accepted"]).encode('utf-8'))
-                import time;time.sleep(10)
+                self.send(self.dispatch(request))
+            except OSError:
                 break
 
     def finish(self):
-        if _active_connection['socket'] == self.request:
-            _active_connection['socket'] = None
+        with _vim_server_lock:
+            _active_connections.discard(self)
+        super().finish()
+
+
+class _VimServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def notify(self, event):
+        with _vim_server_lock:
+            handlers = list(_active_connections)
+        for handler in handlers:
+            try:
+                handler.send([0, event])
+            except OSError:
+                pass
+
+
+class _AsyncVimServer(_VimRequestDispatchMixIn):
+    """Serve every remote client from a single asyncio event loop.
+
+    Replies wait on `drain()`, so a slow client only stalls itself. Stop
+    events are dropped for clients whose send buffer is already full.
+    """
+
+    write_high_water = 1 << 20
+
+    def __init__(self, server_address):
+        self._address = server_address
+        self._started = threading.Event()
+        self._start_error = None
+        self._clients = set()
+        self.loop = None
+        self.server_address = None
+
+    def serve_forever(self):
+        import asyncio
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            server = loop.run_until_complete(
+                asyncio.start_server(self._serve, *self._address)
+            )
+        except OSError as e:
+            self._start_error = e
+            self._started.set()
+            return
+        self.server_address = server.sockets[0].getsockname()[:2]
+        self.loop = loop
+        self._started.set()
+        loop.run_forever()
+
+    def wait_started(self):
+        self._started.wait()
+        if self._start_error is not None:
+            raise self._start_error
+
+    async def _serve(self, reader, writer):
+        import asyncio
+        self._clients.add(writer)
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(_FRAME_HEADER.size)
+                    size, = _FRAME_HEADER.unpack(header)
+                    if size > _FRAME_MAX_SIZE:
+                        break
+                    request = json.loads(await reader.readexactly(size))
+                except (asyncio.IncompleteReadError, ValueError, OSError):
+                    break
+                writer.write(_encode_frame(self.dispatch(request)))
+                await writer.drain()
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    def notify(self, event):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._broadcast, _encode_frame([0, event]))
+
+    def _broadcast(self, data):
+        for writer in self._clients:
+            if writer.transport.get_write_buffer_size() < self.write_high_water:
+                writer.write(data)
+
+
+def _ensure_vim_server(config):
+    global _vim_server, _vim_handler_thread
+    with _vim_server_lock:
+        if _vim_handler_thread is None:
+            address = (config.serve_address, config.serve_port)
+            if config.serve_mode == "asyncio":
+                _vim_server = _AsyncVimServer(address)
+            else:
+                _vim_server = _VimServer(address, _VimRequestHandler)
+            _vim_handler_thread = threading.Thread(target=_vim_server.serve_forever, name="pdbp-vim-server", daemon=True)
+            _vim_handler_thread.start()
+            if config.serve_mode == "asyncio":
+                try:
+                    _vim_server.wait_started()
+                except OSError:
+                    # Let the next session try to bind again
+                    _vim_server = _vim_handler_thread = None
+                    raise
+            host, port = _vim_server.server_address
+            print(f"Process: {os.getpid()}, Listen on {host}:{port}...", flush=True)
+    return _vim_server
+
+
+def _notify_remote(event):
+    for server in (_vim_server, _dap_server):
+        if server is not None:
+            server.notify(event)
+
+
+def _istty(line):
+    try:
+        mode = os.stat(line).st_mode
+        if stat.S_ISCHR(mode):
+            return True
+    except Exception:
+        return False
+
+
+class _VimSession:
+    # `Pdb` is thread-local, so state shared with the server lives here
+    def __init__(self, thread_id):
+        self.thread_id = thread_id
+        self.event = threading.Event()
+        self.waiting = True
+        self.rejected = 0
+        self.tty = None
+        self.stack = None  # published while the thread is stopped
+        self.curindex = 0
+        self.curframe_locals = None
+        self.locals = None  # rendered per frame, not for DAP sessions
+        self.dap = False
+        self.commands = queue.Queue()  # DAP only
+        self.ident = threading.get_ident()  # as sys.monitoring sees it
+        # DAP only. Bound on the thread, reading a `Pdb` attribute from
+        # another one would set up a new instance there
+        self.sync_running = None
+        self.term_size = None  # set by a remote `resize`
+
+
+_term_sizes = weakref.WeakKeyDictionary()  # stream --> os.terminal_size, until the next SIGWINCH
+
+
+def _invalidate_terminal_size(*args):
+    _term_sizes.clear()
+
+
+def _install_sigwinch_handler():
+    # Only the main thread can set handlers; others rely on the main one
+    global _sigwinch_installed
+    if _sigwinch_installed or not hasattr(signal, "SIGWINCH"):
+        return
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGWINCH)
+
+    def _on_sigwinch(signum, frame):
+        _term_sizes.clear()
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGWINCH, _on_sigwinch)
+    _sigwinch_installed = True
+
+
+_sigwinch_installed = False
+
+
+def _gets_sigwinch(stream):
+    # The kernel sends SIGWINCH to the foreground process group of the
+    # resized terminal only, not to a process writing to another PTY
+    if not _sigwinch_installed:
+        return False
+    try:
+        return os.tcgetpgrp(stream.fileno()) == os.getpgrp()
+    except (AttributeError, OSError, ValueError):
+        return False
+
+
+def _stopped_session(thread_id=None):
+    with _vim_server_lock:
+        if thread_id is None:
+            stopped = [s for s in _vim_sessions.values() if s.stack is not None]
+            if len(stopped) != 1:
+                raise LookupError("Specify a thread, %d sessions are stopped" % len(stopped))
+            return stopped[0]
+        session = _vim_sessions.get(thread_id)
+    if session is None or session.stack is None:
+        raise LookupError(f"Thread {thread_id} is not stopped in the debugger")
+    return session
+
+
+def _session_frame(session, index=None):
+    stack = session.stack
+    return stack[session.curindex if index is None else index][0]
+
+
+def _session_locals(session, index=None):
+    # Only on the session's thread. Up to Python 3.12, reading `f_locals`
+    # of the current frame again drops pending `!x = ...` assignments
+    if index is None or index == session.curindex:
+        return session.curframe_locals
+    return _session_frame(session, index).f_locals
+
+
+def _render_locals(f_locals):
+    return {
+        name: {"type": type(value).__name__, "repr": _remote_repr.repr(value)}
+        for name, value in list(f_locals.items())
+    }
+
+
+def _assign_remote_pty(tty, thread_id=None):
+    # Hand the PTY to the requested thread, or to the longest waiting one
+    with _vim_server_lock:
+        if thread_id is None:
+            waiting = [s for s in _vim_sessions.values() if s.waiting]
+            session = waiting[0] if waiting else None
+        else:
+            session = _vim_sessions.get(thread_id)
+        if session is None or not session.waiting:
+            return "no session"
+        if not _istty(tty):
+            session.rejected += 1
+            session.event.set()
+            return "rejected"
+        session.waiting = False
+        session.tty = tty
+        session.event.set()
+        return "accepted"
+
+
+class _DapInput:
+    """Command stream of a DAP-driven `Pdb`, fed by the DAP server.
+
+    Callables queued by the server run here, on the debugged thread.
+    """
+
+    def __init__(self, session):
+        self._commands = session.commands
+
+    def readline(self):
+        while True:
+            item = self._commands.get()
+            if callable(item):
+                item()
+                continue
+            return item + "\n"
+
+
+_ansi_escape = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+
+
+class _DapOutput:
+    def __init__(self, thread_id):
+        self._thread_id = thread_id
+
+    def write(self, s):
+        # DAP clients show output as plain text
+        text = _ansi_escape.sub("", s)
+        if text:
+            _notify_remote({
+                "event": "output", "thread": self._thread_id, "output": text,
+            })
+        return len(s)
+
+    def flush(self):
+        pass
+
+
+def _call_in_session(session, func, timeout=10):
+    """Run `func` on the stopped thread that owns `session`.
+
+    A call still queued after `timeout` is dropped, rather than run at the
+    thread's next stop.
+    """
+    import concurrent.futures
+    if session.stack is None:
+        raise LookupError(
+            f"Thread {session.thread_id} is not stopped in the debugger"
+        )
+    future = concurrent.futures.Future()
+
+    def _call():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func())
+        except BaseException as e:
+            future.set_exception(e)
+    session.commands.put(_call)
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        if future.cancel():
+            with session.commands.mutex:
+                try:
+                    session.commands.queue.remove(_call)
+                except ValueError:
+                    pass
+        raise
+
+
+class _DapRequestHandler(socketserver.StreamRequestHandler):
+    """One Debug Adapter Protocol client, answered straight from frame data."""
+
+    def setup(self):
+        super().setup()
+        self._write_lock = threading.Lock()
+        self._seq = 0
+        self._refs = {}  # variablesReference / frameId --> payload
+        with _vim_server_lock:
+            _active_dap_connections.add(self)
+
+    def finish(self):
+        with _vim_server_lock:
+            _active_dap_connections.discard(self)
+        super().finish()
+
+    def send(self, message):
+        with self._write_lock:
+            self._seq += 1
+            message["seq"] = self._seq
+            data = json.dumps(message).encode("utf-8")
+            self.wfile.write(b"Content-Length: %d\r\n\r\n" % len(data) + data)
+
+    def send_event(self, event, body=None):
+        self.send({"type": "event", "event": event, "body": body or {}})
+
+    def _read_message(self):
+        length = None
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return None
+            line = line.strip()
+            if not line:
+                break
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"content-length":
+                length = int(value)
+        if length is None or length > _FRAME_MAX_SIZE:
+            return None
+        return json.loads(self.rfile.read(length))
+
+    def handle(self):
+        while True:
+            try:
+                request = self._read_message()
+            except (ValueError, OSError):
+                break
+            if request is None:
+                break
+            if request.get("type") != "request":
+                continue
+            command = request.get("command", "")
+            handler = getattr(self, "dap_" + command, None)
+            response = {
+                "type": "response",
+                "request_seq": request.get("seq", 0),
+                "command": command,
+                "success": True,
+            }
+            try:
+                if handler is None:
+                    raise NotImplementedError(
+                        f"Unsupported request: {command}"
+                    )
+                body = handler(request.get("arguments") or {})
+                if body is not None:
+                    response["body"] = body
+            except Exception as e:
+                response["success"] = False
+                response["message"] = f"{type(e).__name__}: {e}"
+            try:
+                self.send(response)
+            except OSError:
+                break
+            if command == "configurationDone":
+                self._replay_stops()
+            elif command == "disconnect":
+                break
+
+    def _replay_stops(self):
+        with _vim_server_lock:
+            stopped = [
+                s.thread_id for s in _vim_sessions.values()
+                if s.stack is not None
+            ]
+        for thread_id in stopped:
+            self.send_event(
+                "stopped", {"reason": "pause", "threadId": thread_id}
+            )
+
+    def _new_ref(self, payload):
+        ref = len(self._refs) + 1
+        self._refs[ref] = payload
+        return ref
+
+    def _variable(self, name, value, session):
+        # On the session's thread, through _call_in_session: repr() runs
+        # user code. The server thread is blocked on the call meanwhile.
+        children = _dap_has_children(value)
+        ref = self._new_ref(("value", value, session)) if children else 0
+        return {
+            "name": str(name),
+            "value": _remote_repr.repr(value),
+            "type": type(value).__name__,
+            "variablesReference": ref,
+        }
+
+    def _resume(self, args, command):
+        session = _stopped_session(args.get("threadId"))
+        self._refs.clear()
+        session.commands.put("_dap_resume " + command)
+        if command == "continue":
+            return {"allThreadsContinued": False}
+        return None
+
+    def dap_initialize(self, args):
+        self.send_event("initialized")
+        return {
+            "supportsConfigurationDoneRequest": True,
+            "supportsEvaluateForHovers": True,
+            "supportsVariablePaging": True,
+        }
+
+    def dap_attach(self, args):
+        pass
+
+    dap_launch = dap_configurationDone = dap_attach
+
+    def dap_disconnect(self, args):
+        with _vim_server_lock:
+            stopped = [
+                s for s in _vim_sessions.values() if s.stack is not None
+            ]
+        for session in stopped:
+            session.commands.put("_dap_resume continue")
+
+    def dap_threads(self, args):
+        with _vim_server_lock:
+            thread_ids = list(_vim_sessions)
+        return {"threads": [
+            {"id": t, "name": f"Thread {t}"} for t in thread_ids
+        ]}
+
+    def dap_stackTrace(self, args):
+        session = _stopped_session(args.get("threadId"))
+        stack = session.stack
+        # DAP lists the innermost frame first, without pdbp's thread wrapper
+        frames = [
+            (index, entry) for index, entry in reversed(list(enumerate(stack)))
+            if entry[0].f_code is not _new_thread_run.__code__
+        ]
+        start = args.get("startFrame", 0)
+        levels = args.get("levels") or len(frames)
+        body = []
+        for index, (frame, lineno) in frames[start:start + levels]:
+            code = frame.f_code
+            body.append({
+                "id": self._new_ref(("frame", session, index)),
+                "name": code.co_name,
+                "source": {"path": code.co_filename},
+                "line": lineno,
+                "column": 1,
+            })
+        return {"stackFrames": body, "totalFrames": len(frames)}
+
+    def dap_scopes(self, args):
+        _, session, index = self._refs[args["frameId"]]
+
+        def _scopes():
+            f_globals = _session_frame(session, index).f_globals
+            f_locals = _session_locals(session, index)
+            return [("Locals", f_locals, len(f_locals)),
+                    ("Globals", f_globals, len(f_globals))]
+        return {"scopes": [
+            {
+                "name": name,
+                "variablesReference": self._new_ref(
+                    ("mapping", mapping, session)
+                ),
+                "namedVariables": size,
+                "expensive": name == "Globals",
+            }
+            for name, mapping, size in _call_in_session(session, _scopes)
+        ]}
+
+    def dap_variables(self, args):
+        kind, value, session = self._refs[args["variablesReference"]]
+        start = args.get("start", 0)
+        count = args.get("count") or None
+        stop = start + count if count else None
+
+        def _variables():
+            if kind == "mapping":
+                items = value.items()
+            else:
+                items = _dap_children(value)
+            return [
+                self._variable(name, child, session)
+                for name, child in itertools.islice(items, start, stop)
+            ]
+        return {"variables": _call_in_session(session, _variables)}
+
+    def dap_evaluate(self, args):
+        _, session, index = self._refs[args["frameId"]]
+        expression = args["expression"]
+
+        def _eval():
+            f_globals = _session_frame(session, index).f_globals
+            f_locals = _session_locals(session, index)
+            value = eval(expression, f_globals, f_locals)
+            return self._variable(expression, value, session)
+        variable = _call_in_session(session, _eval)
+        return {"result": variable["value"], "type": variable["type"],
+                "variablesReference": variable["variablesReference"]}
+
+    def dap_setBreakpoints(self, args):
+        path = os.path.abspath(args["source"]["path"])
+        lines = [bp["line"] for bp in args.get("breakpoints", [])]
+        with _vim_server_lock:
+            global _dap_breakpoints_gen
+            _dap_breakpoints[path] = lines
+            _dap_breakpoints_gen += 1
+            _dap_verified.difference_update(
+                (f, ln) for f, ln in list(_dap_verified)
+                if f == path and ln not in lines
+            )
+            breakpoints = []
+            for line in lines:
+                ids = _dap_breakpoint_ids
+                ident = ids.setdefault((path, line), len(ids) + 1)
+                # Verified once a session has applied it, see _dap_sync
+                breakpoints.append({
+                    "id": ident,
+                    "verified": (path, line) in _dap_verified,
+                    "line": line,
+                    "source": {"path": path},
+                })
+            sessions = [s for s in _vim_sessions.values() if s.dap]
+        for session in sessions:
+            # A session that is just resuming may miss the command
+            if session.stack is not None:
+                session.commands.put("_dap_sync")
+            if hasattr(sys, "monitoring"):
+                try:
+                    _call_in_thread(session.ident, "dap_sync",
+                                    session.sync_running)
+                except ValueError:
+                    pass  # The thread has exited
+        return {"breakpoints": breakpoints}
+
+    def dap_continue(self, args):
+        return self._resume(args, "continue")
+
+    def dap_next(self, args):
+        return self._resume(args, "next")
+
+    def dap_stepIn(self, args):
+        return self._resume(args, "step")
+
+    def dap_stepOut(self, args):
+        return self._resume(args, "return")
+
+
+def _dap_has_children(value):
+    if isinstance(value, (str, bytes, bytearray, int, float, complex, bool,
+                          type(None))):
+        return False
+    if isinstance(value, (dict, list, tuple, set, frozenset)):
+        return len(value) > 0
+    return bool(getattr(value, "__dict__", None))
+
+
+def _dap_children(value):
+    if isinstance(value, dict):
+        return ((repr(k), v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return enumerate(value)
+    if isinstance(value, (set, frozenset)):
+        return enumerate(value)
+    return iter(vars(value).items())
+
+
+class _DapServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def notify(self, event):
+        name = event["event"]
+        if name == "stopped":
+            dap_event = ("stopped", {
+                "reason": event["reason"], "threadId": event["thread"],
+            })
+        elif name == "running":
+            dap_event = ("continued", {"threadId": event["thread"]})
+        elif name == "output":
+            dap_event = ("output", {
+                "category": "console", "output": event["output"],
+            })
+        elif name == "breakpoint":
+            dap_event = ("breakpoint", {"reason": "changed", "breakpoint": {
+                "id": event["id"],
+                "verified": True,
+                "line": event["lineno"],
+                "source": {"path": event["filename"]},
+            }})
+        else:
+            return
+        with _vim_server_lock:
+            handlers = list(_active_dap_connections)
+        for handler in handlers:
+            try:
+                handler.send_event(*dap_event)
+            except OSError:
+                pass
+
+
+def _ensure_dap_server(config):
+    global _dap_server
+    with _vim_server_lock:
+        if _dap_server is None:
+            _dap_server = _DapServer(
+                (config.serve_address, config.dap_port), _DapRequestHandler
+            )
+            threading.Thread(
+                target=_dap_server.serve_forever,
+                name="pdbp-dap-server",
+                daemon=True,
+            ).start()
+            host, port = _dap_server.server_address
+            print(f"Process: {os.getpid()}, DAP on {host}:{port}...",
+                  flush=True)
+    return _dap_server
+
 
 if __name__ != "__main__":
     _thread_list = []
     _ori_thread_run = threading.Thread.run
     threading.Thread.run = _new_thread_run 
     _atexit_registered = 0
+    _vim_server = None
     _vim_handler_thread = None
-    _active_connection = {'socket': None}
+    _vim_server_lock = threading.Lock()
+    _vim_sessions = {}  # thread id --> _VimSession
+    _active_connections = set()
+    _dap_server = None
+    _active_dap_connections = set()
+    _dap_breakpoints = {}  # filename --> lines requested by DAP clients
+    _dap_breakpoints_gen = 0
+    _dap_breakpoint_ids = {}  # (filename, line) --> DAP breakpoint id
+    _dap_verified = set()  # (filename, line) applied by a session
+    _thread_calls = {}  # thread ident --> {key: func(frame)}
+    _thread_calls_lock = threading.Lock()
+    _thread_calls_tool = None
 
 class _TLocalTextIOWrapper(threading.local):
     _ori_stream: io.TextIOWrapper
     _new_stream: io.TextIOWrapper
     _cur_stream: io.TextIOWrapper
 
+    # Hot methods are bound per thread, so they never reach `__getattr__`
+    _bound_names = ("write", "flush", "readline", "writelines", "isatty", "fileno")
+
     def __init__(self, _ori_ori, _ori):
         self._ori_ori_stream = _ori_ori
-        self._cur_stream = self._ori_stream = _ori
-    
+        self._ori_stream = _ori
+        self._bind(_ori)
+
     def __getattr__(self, _name):
         return getattr(self._cur_stream, _name)
-    
+
+    def _bind(self, _stream):
+        self._cur_stream = _stream
+        _dict = self.__dict__
+        for _name in self._bound_names:
+            _dict[_name] = getattr(_stream, _name)
+
     def _set_new(self, _new):
-        self._cur_stream = self._new_stream = _new
+        self._new_stream = _new
+        self._bind(_new)
 
     def _to_ori(self):
-        self._cur_stream = self._ori_stream
+        self._bind(self._ori_stream)
 
     def _to_new(self):
-        self._cur_stream = self._new_stream
-    
+        self._bind(self._new_stream)
+
     def _clean(self):
         self._ori_stream.close()
 
@@ -521,20 +2033,39 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
         if self.config.disable_pytest_capturing:
             self._disable_pytest_capture_maybe()
         kwargs = self.config.default_pdb_kwargs.copy()
-        kwargs.update({**kwds, "skip": ["pdbp"]})
+        kwargs.update(kwds)
+        kwargs["skip"] = ["pdbp", *(kwargs.get("skip") or ())]
         super().__init__(*args, **kwargs)
+        # Frozen, so that the cached skip decisions can be keyed on it
+        self.skip = frozenset(self.skip)
+        self._skip_key = None
+        self._refresh_skip_state()
         self.stderr = self.stdout
         self.prompt = self.config.prompt
-        self.display_list = {}  # frame --> (name --> last seen value)
+        # code --> (name --> (fingerprint, bounded repr)). Frames cannot be
+        # weakly referenced, so displays are kept per function code object.
+        self.display_list = _CodeCache()
         self.sticky = self.config.sticky_by_default
         self.first_time_sticky = self.sticky
         self.ok_to_clear = False
         self.has_traceback = False
         self.sticky_ranges = {}  # frame --> (start, end)
+        self._locals_snapshot = None  # ((frame id, code), name --> value)
+        self._stack_entry_cache = {}  # (frame id, lineno, prefix) --> entry, per stop
+        self._where_start = None
+        self._task_list = []  # tasks as numbered by the last `tasks`
+        self._step_task = None  # (loop, task) followed by step/next/return
+        self._finish_user = None  # frame left by `finish_user`
+        self._until_monitor = None  # _UntilMonitor of a running `until`
+        self._profile = None  # running or unreported _Profile
+        self._profile_sigint = None  # (handler, previous) while profiling
+        self._memsnaps = []  # tracemalloc snapshots taken by `memsnap`
         self.tb_lineno = {}  # frame --> lineno where the exception was raised
         self.history = []
         self.show_hidden_frames = False
         self._hidden_frames = []
+        # (key, [(frame id, code, hidden)]) of the last computed stack
+        self._hidden_flags = None
         self.saved_curframe = None
         self.last_cmd = None
         self._thread_id = _thread.get_native_id()
@@ -557,6 +2088,7 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
         if hasattr(self, "old_stdin"):
             if os.environ.get("_PDB_W_MT", ""):
                 self.stdin.readline = _rl_patch.pty_readline
+                _stdio_to_new()
             self.cmdqueue.append("_ext_pty")
     
     def __init__(self, *args, **kwds):
@@ -567,15 +2099,12 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
         if not _atexit_registered and os.getpid() == self._thread_id:
             atexit.register(self._cleanup)
             _atexit_registered = 1
+        _install_sigwinch_handler()
 
-        if not os.environ.get("_PDB_DISABLE_PTY", ""):
-            global _vim_handler_thread
-            if not _vim_handler_thread:
-                pass
-
+        if self.config.dap_port is not None:
+            self.dap_conn()
+        elif not os.environ.get("_PDB_DISABLE_PTY", ""):
             self.vim_conn()
-            print(self._ext_pty)
-            exit()
 
             _stdio_set_tlocal()
             master, slave = pty.openpty()
@@ -609,50 +2138,94 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
                 self.cmdqueue.append("_acquire")
             else:
                 self.stdin.readline = _rl_patch.pty_readline
+            # Rebind the thread-local stdio proxies to the patched methods
+            _stdio_to_new()
             self.cmdqueue.append("_ext_pty")
 
     def vim_conn(self):
-        _retry_counter = 0
+        server = _ensure_vim_server(self.config)
+        session = _VimSession(self._thread_id)
+        with _vim_server_lock:
+            _vim_sessions[self._thread_id] = session
+        host, port = server.server_address
+        print(f"Process: {os.getpid()}, Thread: {self._thread_id}, Wait for a PTY on {host}:{port}...", flush=True)
         while 1:
-            try:
-                _retry_counter += 1
-                self._ext_pty = self._get_remote_pty()
-            except PtyFetchError:
-                if _retry_counter > self.config.serve_max_retry:
-                    raise
-                continue
-            else:
+            session.event.wait()
+            session.event.clear()
+            if not session.waiting:
                 break
+            if session.rejected > self.config.serve_max_retry:
+                with _vim_server_lock:
+                    session.waiting = False
+                    _vim_sessions.pop(self._thread_id, None)
+                raise PtyFetchError("Cannot fetch an available PTY for debugging!")
+        self._ext_pty = session.tty
+        self._vim_session = session
+
+    def dap_conn(self):
+        _ensure_dap_server(self.config)
+        session = _VimSession(self._thread_id)
+        session.waiting = False
+        session.dap = True
+        with _vim_server_lock:
+            _vim_sessions[self._thread_id] = session
+        self._vim_session = session
+        session.sync_running = self._dap_sync_running
+        self._dap_breaks = set()
+        self._dap_breakpoints_gen = -1
+        self.stdin = _DapInput(session)
+        self.stdout = self.stderr = _DapOutput(self._thread_id)
+        self.use_rawinput = False
+        # The client renders frames itself, keep the console output plain
+        self.sticky = self.first_time_sticky = False
+        self.config.highlight = False
+
+    def _dap_sync(self):
+        # Apply the breakpoints DAP clients set since the last stop
+        with _vim_server_lock:
+            if self._dap_breakpoints_gen == _dap_breakpoints_gen:
+                return
+            self._dap_breakpoints_gen = _dap_breakpoints_gen
+            wanted = {
+                (f, ln) for f, lines in _dap_breakpoints.items()
+                for ln in lines
+            }
+        for filename, lineno in self._dap_breaks - wanted:
+            self.clear_break(filename, lineno)
+        for filename, lineno in wanted - self._dap_breaks:
+            if self.set_break(filename, lineno):
+                wanted.discard((filename, lineno))
+        self._dap_breaks = wanted
+        with _vim_server_lock:
+            applied = wanted - _dap_verified
+            _dap_verified.update(applied)
+        for filename, lineno in sorted(applied):
+            _notify_remote({
+                "event": "breakpoint",
+                "id": _dap_breakpoint_ids[filename, lineno],
+                "filename": filename,
+                "lineno": lineno,
+            })
 
-    def _get_remote_pty(self):
-        _ext_pty = None
-        class _handler(socketserver.BaseRequestHandler):
-            def handle(sock):
-                nonlocal _ext_pty
-                while True:
-                    try:
-                        data = sock.request.recv(4096).decode('utf-8')
-                    except socket.error:
-                        break
-                    if data == '':
-                        break
-                    try:
-                        decoded = json.loads(data)
-                    except ValueError:
-                        continue
-                    assert decoded[0] >= 0
-                    if self._istty(decoded[1]):
-                        _ext_pty = decoded[1]
-                        sock.request.sendall(json.dumps([decoded[0], "accepted"]).encode('utf-8'))
-                        import time;time.sleep(10)
-                        break
-        with socketserver.TCPServer((self.config.serve_address, self.config.serve_port), _handler) as server:
-            host, port = server.server_address
-            print(f"Process: {os.getpid()}, Thread: {self._thread_id}, Listen on {host}:{port}...")
-            server.handle_request()
-        if not _ext_pty:
-            raise PtyFetchError("Cannot fetch an available PTY for debugging!")
-        return _ext_pty
+    def _dap_sync_running(self, frame):
+        # Called on the thread while it runs: apply the new breakpoints and
+        # trace its frames again, `continue` may have stopped tracing.
+        # While stopped, the queued `_dap_sync` command applies them.
+        if getattr(_interacting, "active", False):
+            return False
+        self._dap_sync()
+        if self.breaks:
+            while frame is not None:
+                frame.f_trace = self.trace_dispatch
+                frame = frame.f_back
+            sys.settrace(self.trace_dispatch)
+
+    def do__dap_sync(self, arg):
+        self._dap_sync()
+
+    def do__dap_resume(self, arg):
+        # Spelled out here, "n" or "s" could be shadowed by a local variable
+        return getattr(self, "do_" + arg)("")
 
     def _another_tty_init(self, master):
         termios.tcsetattr(master, termios.TCSANOW, termios.tcgetattr(sys.stdin._ori_stream))
@@ -677,15 +2250,13 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
         self.print_stack_entry(self.stack[self.curindex])
 
     def _istty(self, line):
-        try:
-            mode = os.stat(line).st_mode
-            if stat.S_ISCHR(mode):
-                return True
-        except Exception:
-            return False
+        return _istty(line)
 
     def do__ext_pty(self, arg):
         if hasattr(self, "_ext_pty"):
+            if not hasattr(self, "_ext_stdin"):
+                # Assigned by a remote client through `vim_conn`
+                self._load_ext_pty(self._ext_pty)
             return
         if hasattr(self, "parent"):
             self._ext_pty = self.parent._ext_pty
@@ -697,9 +2268,11 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
 
     def do_clean(self, arg):
         """ clean
-        
-        Clear the screen.
+
+        Clear the screen, and pick up the size of a resized terminal
+        right away instead of at the next prompt.
         """
+        _invalidate_terminal_size()
         self.stdout.write(CLEARSCREEN)
 
     def do_EOF(self, arg):
@@ -911,6 +2484,7 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
             self._exchange_stdio()
 
     def _choose_ext_stdio(self):
+        self.stdout.flush()
         return {
             "stdin": self.stdin if hasattr(self, "_ext_stdin") else self.old_stdin,
             "stdout": getattr(self, "_ext_stdout", self.old_stdout),
@@ -946,6 +2520,9 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
         if self._thread_id in _thread_list:
             _thread_list.remove(self._thread_id)
 
+        with _vim_server_lock:
+            _vim_sessions.pop(self._thread_id, None)
+
         if hasattr(self, "old_stdin"):
             if _thread_list:
                 _rl_patch.close_f_pty()
@@ -972,9 +2549,44 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
 
         _pdb_lock.release()
     
+    def _terminal_stream(self):
+        f_o = getattr(self, "_ext_stdout", self.stdout)
+        if isinstance(f_o, _CycleBuffer):
+            # Its fileno() flushes, which would split the rendered cycle
+            f_o = f_o.stream
+        if isinstance(f_o, _TLocalTextIOWrapper):
+            # Shared by all threads, each with its own stream
+            f_o = f_o._cur_stream
+        return f_o
+
+    def _refresh_terminal_size(self):
+        # A terminal that does not send us SIGWINCH is queried again once
+        # per prompt, rather than on every render
+        f_o = self._terminal_stream()
+        if not _gets_sigwinch(f_o):
+            try:
+                _term_sizes.pop(f_o, None)
+            except TypeError:
+                pass
+
     def get_terminal_size(self):
+        session = getattr(self, "_vim_session", None)
+        if session is not None and session.term_size is not None:
+            return session.term_size
+        f_o = self._terminal_stream()
+        try:
+            return _term_sizes[f_o]
+        except (KeyError, TypeError):
+            pass
+        size = self._query_terminal_size(f_o)
+        try:
+            _term_sizes[f_o] = size
+        except TypeError:
+            pass  # Not weakly referenceable, queried every time
+        return size
+
+    def _query_terminal_size(self, f_o):
         try:
-            f_o = getattr(self, "_ext_stdout", self.stdout)
             return os.get_terminal_size(f_o.fileno())
         except Exception:
             if "linux" in sys.platform:
@@ -1065,6 +2677,18 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
             pass
 
     def interaction(self, frame, traceback):
+        stdout = self.stdout
+        if not self.config.buffer_output or isinstance(stdout, _CycleBuffer):
+            return self._interaction(frame, traceback)
+        self.stdout = _CycleBuffer(stdout)
+        try:
+            return self._interaction(frame, traceback)
+        finally:
+            if isinstance(self.stdout, _CycleBuffer) and self.stdout.stream is stdout:
+                self.stdout.flush()
+                self.stdout = stdout
+
+    def _interaction(self, frame, traceback):
         # Restore the previous signal handler at the Pdb+ prompt.
         if getattr(pdb.Pdb, "_previous_sigint_handler", None):
             try:
@@ -1112,13 +2736,62 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
         if isinstance(traceback, BaseException):
             return super().interaction(frame, traceback)
         self.config.before_interaction_hook(self)
-        # Use _cmdloop on Python3, which catches KeyboardInterrupt.
-        if hasattr(self, "_cmdloop"):
-            self._cmdloop()
-        else:
-            self.cmdloop()
+        session = getattr(self, "_vim_session", None)
+        _interacting.active = True
+        try:
+            # Use _cmdloop on Python3, which catches KeyboardInterrupt.
+            if hasattr(self, "_cmdloop"):
+                self._cmdloop()
+            else:
+                self.cmdloop()
+        finally:
+            _interacting.active = False
+            if session is not None:
+                session.stack = None
+                _notify_remote({"event": "running", "thread": self._thread_id})
         self.forget()
 
+    def _publish_stop(self, notify=False):
+        session = getattr(self, "_vim_session", None)
+        if session is not None:
+            session.curindex = self.curindex
+            session.curframe_locals = self.curframe_locals
+            if not session.dap:
+                # Rendered here, remote clients read them from other threads
+                session.locals = [
+                    _render_locals(self.curframe_locals
+                                   if index == self.curindex
+                                   else frame.f_locals)
+                    for index, (frame, _) in enumerate(self.stack)
+                ]
+            session.stack = list(self.stack)
+            if notify:
+                frame, lineno = self.stack[self.curindex]
+                if self.has_traceback:
+                    reason = "exception"
+                elif self.get_breaks(
+                    self.canonic(frame.f_code.co_filename), lineno
+                ):
+                    reason = "breakpoint"
+                else:
+                    reason = "step"
+                _notify_remote({
+                    "event": "stopped",
+                    "reason": reason,
+                    "thread": self._thread_id,
+                    "filename": frame.f_code.co_filename,
+                    "lineno": lineno,
+                    "function": frame.f_code.co_name,
+                })
+
+    def postcmd(self, stop, line):
+        if not stop:
+            self._publish_stop()
+        stop = super().postcmd(stop, line)
+        # Everything the command printed goes out before the next prompt
+        self.stdout.flush()
+        return stop
+
     def print_hidden_frames_count(self):
         n = len(self._hidden_frames)
         if n and self.config.show_hidden_frames_count:
@@ -1130,6 +2803,12 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
             )
 
     def setup(self, frame, tb):
+        # Frames cannot be weakly referenced; drop the previous traceback's
+        self.tb_lineno.clear()
+        self._stack_entry_cache.clear()
+        self._where_start = None
+        self._disarm_until()
+        self._stop_profile()
         ret = super().setup(frame, tb)
         if not ret:
             while tb:
@@ -1141,9 +2820,9 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
     def _is_hidden(self, frame):
         if not self.config.enable_hidden_frames:
             return False
+        decorated, local_hide = _code_hide_info(frame.f_code)
         # Decorated code is always considered to be hidden.
-        consts = frame.f_code.co_consts
-        if consts and consts[-1] is _HIDE_FRAME:
+        if decorated:
             return True
         # Don't hide if this frame contains the initial set_trace.
         if frame is getattr(self, "_via_set_trace_frame", None):
@@ -1151,7 +2830,7 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
         if frame.f_globals.get("__unittest"):
             return True
         if (
-            frame.f_locals.get("__tracebackhide__")
+            (local_hide and frame.f_locals.get("__tracebackhide__"))
             or frame.f_globals.get("__tracebackhide__")
         ):
             return True
@@ -1167,13 +2846,30 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
             idx = len(fullstack) - 1
         if self.show_hidden_frames:
             return fullstack, idx
+        # Frames below the ones that changed since the last stop keep
+        # their classification.
+        via = getattr(self, "_via_set_trace_frame", None)
+        key = id(via), self.config.enable_hidden_frames
+        flags = []
+        previous = self._hidden_flags
+        if previous is not None and previous[0] == key:
+            for (frame, _), (frame_id, co, hidden) in zip(fullstack, previous[1]):
+                if id(frame) != frame_id or frame.f_code is not co:
+                    break
+                flags.append(hidden)
+        for frame, _ in fullstack[len(flags):]:
+            flags.append(bool(self._is_hidden(frame)))
+        self._hidden_flags = key, [
+            (id(frame), frame.f_code, hidden)
+            for (frame, _), hidden in zip(fullstack, flags)
+        ]
         self._hidden_frames = []
         newstack = []
-        for frame, lineno in fullstack:
-            if self._is_hidden(frame):
-                self._hidden_frames.append((frame, lineno))
+        for entry, hidden in zip(fullstack, flags):
+            if hidden:
+                self._hidden_frames.append(entry)
             else:
-                newstack.append((frame, lineno))
+                newstack.append(entry)
         newidx = idx - len(self._hidden_frames)
         return newstack, newidx
 
@@ -1266,6 +2962,17 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
     stack_entry_regexp = re.compile(r"(.*?)\(([0-9]+?)\)(.*)", re.DOTALL)
 
     def format_stack_entry(self, frame_lineno, lprefix=": "):
+        frame, lineno = frame_lineno
+        key = id(frame), lineno, lprefix, self.config.highlight
+        try:
+            return self._stack_entry_cache[key]
+        except KeyError:
+            pass
+        entry = self._format_stack_entry(frame_lineno, lprefix)
+        self._stack_entry_cache[key] = entry
+        return entry
+
+    def _format_stack_entry(self, frame_lineno, lprefix):
         entry = super().format_stack_entry(frame_lineno, lprefix)
         entry = self.try_to_decode(entry)
         if self.config.highlight:
@@ -1273,8 +2980,8 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
             if match:
                 filename, lineno, other = match.groups()
                 other = self.format_source(other.rstrip()).rstrip()
-                filename = Color.set(self.config.filename_color, filename)
-                lineno = Color.set(self.config.line_number_color, lineno)
+                filename = _color_prefix(self.config.filename_color) + filename + "\x1b[00m"
+                lineno = _color_prefix(self.config.line_number_color) + lineno + "\x1b[00m"
                 entry = "%s(%s)%s" % (filename, lineno, other)
         return entry
 
@@ -1294,17 +3001,25 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
                 return src
         from pygments import highlight
         src = self.try_to_decode(src)
+        if self.config.highlighter == "tokenize":
+            if not hasattr(self, "_token_highlighter"):
+                self._token_highlighter = _TokenHighlighter(self._fmt)
+            rt = self._token_highlighter.highlight(src)
+            return (rt, None) if return_str_code else rt
         rt = highlight(src, self._lexer, self._fmt)
         if return_str_code:
-            str_code = re.match(r".*(38;5;\d+)manystr.*", highlight("'anystr'", self._lexer, self._fmt)).group(1)
-            return rt, str_code
+            if not hasattr(self, "_str_code"):
+                sample = highlight("'anystr'", self._lexer, self._fmt)
+                match = re.match(r".*(38;5;\d+)manystr.*", sample)
+                self._str_code = match.group(1) if match else None
+            return rt, self._str_code
         else:
             return rt 
 
     def format_line(self, lineno, marker, line):
         lineno = "%4d" % lineno
         if self.config.highlight:
-            lineno = Color.set(self.config.line_number_color, lineno)
+            lineno = _color_prefix(self.config.line_number_color) + lineno + "\x1b[00m"
         line = "%s  %2s %s" % (lineno, marker, line)
         if self.config.highlight and marker == "->":
             if self.config.current_line_color:
@@ -1449,11 +3164,11 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
     def _printlonglist(self, linerange=None, fnln=None, nc_fnln=""):
         try:
             if self.curframe.f_code.co_name == "<module>":
-                lines, _ = inspect.findsource(self.curframe)
+                lines, _ = self._findsource(self.curframe)
                 lineno = 1
             else:
                 try:
-                    lines, lineno = inspect.getsourcelines(self.curframe)
+                    lines, lineno = self._getsourcelines(self.curframe)
                 except Exception:
                     print(file=self.stdout)
                     self.sticky = False
@@ -1479,6 +3194,12 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
             lineno = start
         self._print_lines_pdbp(lines, lineno, fnln=fnln, nc_fnln=nc_fnln)
 
+    def _findsource(self, frame):
+        return inspect.findsource(frame)
+
+    def _getsourcelines(self, frame):
+        return inspect.getsourcelines(frame)
+
     def _print_lines_pdbp(
         self, lines, lineno, print_markers=True, fnln=None, nc_fnln=""
     ):
@@ -1597,6 +3318,11 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
         oldstdout = self.stdout
         self.stdout = StringIO()
         super().do_list(arg)
+        if self.config.highlighter == "tokenize":
+            src = self._format_listing(self.stdout.getvalue())
+            self.stdout = oldstdout
+            print(src, file=self.stdout, end="\n\033[F")
+            return
         src, str_code = self.format_source(self.stdout.getvalue(), return_str_code=True)
         if str_code is not None and str_code != self.config.line_number_color:
             def _re_lineno_helper(ma):
@@ -1607,10 +3333,30 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
                     return f"{gp1}{self.config.line_number_color}{gp2}"
                 else:
                     return f"{gp1}{self.config.line_number_color}{gp2}\x1b[39m\x1b[{str_code}m{gp3}"
-            src = re.sub(rf"(\x1b\[38;5;15m[ ]+\x1b\[39m\x1b\[)?{str_code}(m\d+\x1b\[39m.*\n)|(\x1b\[){str_code}(m[ ]*\d+)(.*\x1b\[39m\n)", _re_lineno_helper, src)
+            src = _listing_lineno_re(str_code).sub(_re_lineno_helper, src)
         self.stdout = oldstdout
         print(src, file=self.stdout, end="\n\033[F")
 
+    def _format_listing(self, text):
+        # Highlight the code column only and color the line numbers directly
+        heads = []
+        codes = []
+        for line in text.splitlines():
+            head, tab, code = line.partition("\t")
+            if not tab:
+                head, code = line, ""
+            heads.append(head + tab)
+            codes.append(code)
+        if self.config.highlight:
+            colored = self.format_source("\n".join(codes)).splitlines()
+            codes = colored + [""] * (len(codes) - len(colored))
+            heads = [
+                Color.set(self.config.line_number_color, head)
+                if head[:1] == " " else head
+                for head in heads
+            ]
+        return "\n".join(head + code for head, code in zip(heads, codes))
+
     do_list.__doc__ = pdb.Pdb.do_list.__doc__
     do_l = do_list
     
@@ -1640,6 +3386,231 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
     do_until.__doc__ = pdb.Pdb.do_until.__doc__
     do_unt = do_until
 
+    def do_profile(self, arg):
+        """ profile <seconds> [file]
+
+        Continue for <seconds> while sampling the stacks of all threads
+        from a background thread (nothing is traced), then stop and list
+        the lines and functions where the time went. Ctrl-C stops early.
+        With a file, the samples are also written as collapsed stacks
+        for flamegraph tools.
+        """
+        args = arg.split()
+        try:
+            seconds = float(args[0])
+            if seconds <= 0 or len(args) > 2:
+                raise ValueError
+        except (IndexError, ValueError):
+            self.error("Usage: profile <seconds> [file]")
+            return
+        thread_id = threading.get_ident()
+        main = thread_id == threading.main_thread().ident
+        if not main and not hasattr(sys, "monitoring"):
+            self.error("Profiling a non-main thread requires Python 3.12+")
+            return
+        profile = _Profile(
+            seconds,
+            1.0 / self.config.profile_sample_rate,
+            os.path.expanduser(args[1]) if len(args) > 1 else None,
+        )
+        if main:
+            def _handler(signum, frame):
+                signal.signal(signal.SIGINT, previous)
+                # A late signal, once a breakpoint already ended the profile
+                if profile.closed:
+                    return
+                profile.stop()
+                set_trace(frame)
+
+            previous = signal.signal(signal.SIGINT, _handler)
+            self._profile_sigint = _handler, previous
+            profile.on_done = lambda: signal.pthread_kill(thread_id, signal.SIGINT)
+        else:
+            profile.on_done = lambda: _break_in_thread(thread_id)
+        self.last_cmd = self.lastcmd = "profile"
+        self._profile = profile
+        profile.thread.start()
+        self.set_continue()
+        return 1
+
+    def _stop_profile(self):
+        profile = self._profile
+        if profile is None:
+            return
+        profile.stop()
+        profile.closed = True
+        if profile.thread is not threading.current_thread():
+            profile.thread.join()
+        if self._profile_sigint is not None:
+            handler, previous = self._profile_sigint
+            self._profile_sigint = None
+            if signal.getsignal(signal.SIGINT) is handler:
+                signal.signal(signal.SIGINT, previous)
+
+    def _print_profile(self, profile):
+        total = profile.samples
+        print("Profile: %d samples in %.1fs (percentages are per thread)"
+              % (total, profile.elapsed),
+              file=self.stdout)
+        if not total:
+            return
+        top = self.config.profile_top
+        highlight = self.config.highlight
+
+        def _where(filename, lineno):
+            filename = self._shorten_path(self.canonic(filename))
+            lineno = str(lineno)
+            if highlight:
+                filename = Color.set(self.config.filename_color, filename)
+                lineno = Color.set(self.config.line_number_color, lineno)
+            return "%s:%s" % (filename, lineno)
+
+        print("Top lines (samples at the top of a stack):", file=self.stdout)
+        for (co, lineno), count in profile.lines.most_common(top):
+            print("  %5.1f%%  %s  %s()" % (
+                100.0 * count / total, _where(co.co_filename, lineno),
+                co.co_name), file=self.stdout)
+        print("Top functions (self, total):", file=self.stdout)
+        functions = sorted(
+            profile.functions().items(), key=lambda item: item[1], reverse=True
+        )
+        for co, (own, anywhere) in functions[:top]:
+            print("  %5.1f%%  %5.1f%%  %s()  %s" % (
+                100.0 * own / total, 100.0 * anywhere / total, co.co_name,
+                _where(co.co_filename, co.co_firstlineno)), file=self.stdout)
+        if profile.output:
+            try:
+                with open(profile.output, "w") as f:
+                    for (name, codes), count in profile.stacks.items():
+                        frames = ";".join(
+                            "%s (%s:%d)" % (co.co_name, self._shorten_path(
+                                co.co_filename), co.co_firstlineno)
+                            for co in codes
+                        )
+                        f.write("%s;%s %d\n" % (name, frames, count))
+            except OSError as exc:
+                self.error("Cannot write %s: %s" % (profile.output, exc))
+            else:
+                print("Collapsed stacks written to %s" % profile.output,
+                      file=self.stdout)
+
+    def do_memsnap(self, arg):
+        """ memsnap [start [N] | stop]
+
+        Take a tracemalloc snapshot, numbered for "memdiff". Tracing
+        costs nothing until "memsnap start" (keeping N frames per
+        allocation); "memsnap stop" ends it and drops the snapshots.
+        """
+        import tracemalloc
+        args = arg.split()
+        if args[:1] == ["start"]:
+            try:
+                nframes = int(args[1]) if len(args) > 1 else 1
+                tracemalloc.start(nframes)
+            except ValueError as exc:
+                self.error("Usage: memsnap start [N] (%s)" % exc)
+                return
+            print("tracemalloc started", file=self.stdout)
+        elif args[:1] == ["stop"]:
+            tracemalloc.stop()
+            self._memsnaps.clear()
+            print("tracemalloc stopped", file=self.stdout)
+        elif args:
+            self.error("Usage: memsnap [start [N] | stop]")
+        elif not tracemalloc.is_tracing():
+            self.error('tracemalloc is not tracing; use "memsnap start"')
+        else:
+            snapshot = self._take_memsnap()
+            self._memsnaps.append(snapshot)
+            stats = snapshot.statistics("filename")
+            print("Snapshot %d: %d blocks, %s" % (
+                len(self._memsnaps) - 1,
+                sum(stat.count for stat in stats),
+                _format_size(sum(stat.size for stat in stats)),
+            ), file=self.stdout)
+
+    def _take_memsnap(self):
+        import linecache
+        import tracemalloc
+        # Leave out what the debugger itself allocates at the prompt
+        debugger_files = [__file__, tracemalloc.__file__, linecache.__file__,
+                          tokenize.__file__, pdb.__file__, pdb.bdb.__file__,
+                          pdb.cmd.__file__, tabcompleter.__file__,
+                          "<frozen importlib._bootstrap*>", "<unknown>"]
+        pygments = sys.modules.get("pygments")
+        if pygments is not None:
+            debugger_files.append(os.path.join(os.path.dirname(pygments.__file__), "*"))
+        for pattern in debugger_files:
+            # Compile the patterns before the snapshot, not into it
+            fnmatch.fnmatch("", pattern)
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, pattern) for pattern in debugger_files]
+        )
+
+    def do_memdiff(self, arg):
+        """ memdiff [A [B]]
+
+        List the file:line sites whose allocations grew or shrank most
+        from snapshot A (default: the last one) to snapshot B (default:
+        now). Use "edit file:line" to open a site.
+        """
+        import linecache
+        import tracemalloc
+        if not tracemalloc.is_tracing() or not self._memsnaps:
+            self.error('No snapshot to compare; use "memsnap start" and "memsnap"')
+            return
+        try:
+            indexes = [int(x) for x in arg.split()]
+            if len(indexes) > 2:
+                raise ValueError
+            old = self._memsnaps[indexes[0] if indexes else -1]
+            new = (
+                self._memsnaps[indexes[1]] if len(indexes) > 1
+                else self._take_memsnap()
+            )
+        except (ValueError, IndexError):
+            self.error("Usage: memdiff [A [B]], with snapshots 0-%d"
+                       % (len(self._memsnaps) - 1))
+            return
+        stats = [st for st in new.compare_to(old, "lineno") if st.size_diff]
+        total = sum(st.size_diff for st in stats)
+        print("%s in %d sites" % (_format_size(total, sign=True), len(stats)),
+              file=self.stdout)
+        for st in stats[:self.config.memdiff_top]:
+            frame = st.traceback[0]
+            filename = self._shorten_path(frame.filename)
+            lineno = str(frame.lineno)
+            if self.config.highlight:
+                filename = Color.set(self.config.filename_color, filename)
+                lineno = Color.set(self.config.line_number_color, lineno)
+            print("%10s %+8d blocks  %s:%s" % (
+                _format_size(st.size_diff, sign=True), st.count_diff,
+                filename, lineno), file=self.stdout)
+            line = linecache.getline(frame.filename, frame.lineno).strip()
+            if line:
+                if self.config.highlight:
+                    line = self.format_source(line).rstrip()
+                print("    %s" % line, file=self.stdout)
+
+    def do_finish_user(self, arg):
+        """ fu(finish_user)
+
+        Continue until a line of user code runs in another frame than
+        the current one: the user code that called into a library, or
+        a user callback. Library frames on the way are not traced.
+        """
+        self.last_cmd = self.lastcmd = "finish_user"
+        frame = self.curframe
+        # Callers that were entered untraced get a local trace function,
+        # so that the return into them is seen.
+        for caller, _ in self.stack[:self.curindex]:
+            if caller.f_trace is None and self._is_user_code(caller):
+                caller.f_trace = self.trace_dispatch
+        self.set_step()
+        self._finish_user = frame
+        return 1
+    do_fu = do_finish_user
+
     def do_p(self, arg):
         try:
             self.message(repr(self._getval(arg)))
@@ -1747,7 +3718,10 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
             track(val)
 
     def _get_display_list(self):
-        return self.display_list.setdefault(self.curframe, {})
+        return self.display_list.setdefault(self.curframe.f_code, {})
+
+    def _display_entry(self, value):
+        return _fingerprint(value, self.config), _remote_repr.repr(value)
 
     def _getval_or_undefined(self, arg):
         try:
@@ -1761,7 +3735,7 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
             value = self._getval_or_undefined(arg)
         except Exception:
             return
-        self._get_display_list()[arg] = value
+        self._get_display_list()[arg] = self._display_entry(value)
 
     def do_undisplay(self, arg):
         try:
@@ -1769,6 +3743,55 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
         except KeyError:
             print("** %s not in the display list **" % arg, file=self.stdout)
 
+    def do_watch(self, arg):
+        """ watch [obj.attr | Cls.attr | container[key]]
+
+        Stop whenever the attribute or item is changed, showing the old and
+        new values. A class attribute watches all instances. Without an
+        argument, list the watchpoints.
+        """
+        if not arg:
+            with _watch_lock:
+                for num, watch in _watches.items():
+                    print(f"{num:>3} {watch.desc} (hits: {watch.hits})", file=self.stdout)
+            return
+        import ast
+        try:
+            node = ast.parse(arg.strip(), mode="eval").body
+        except SyntaxError:
+            self.error("Usage: watch obj.attr | Cls.attr | container[key]")
+            return
+        frame = self.curframe
+
+        def _eval(sub):
+            return eval(compile(ast.Expression(sub), "<watch>", "eval"),
+                        frame.f_globals, self.curframe_locals)
+
+        try:
+            if isinstance(node, ast.Attribute):
+                num = watch_attr(_eval(node.value), node.attr)
+            elif isinstance(node, ast.Subscript):
+                num = watch_item(_eval(node.value), _eval(node.slice))
+            else:
+                self.error("Usage: watch obj.attr | Cls.attr | container[key]")
+                return
+        except Exception as exc:
+            self.error(f"Cannot watch {arg}: {exc!r}")
+            return
+        print(f"Watchpoint {num}: {_watches[num].desc}", file=self.stdout)
+
+    def do_unwatch(self, arg):
+        """ unwatch [num ...]
+
+        Remove the given watchpoints, or all of them.
+        """
+        nums = arg.split() if arg else list(_watches)
+        for num in nums:
+            try:
+                unwatch(int(num))
+            except ValueError:
+                self.error(f"Invalid watchpoint number {num}")
+
     def __get_return_color(self, s):
         frame, lineno = self.stack[self.curindex]
         if self.has_traceback or "__exception__" in frame.f_locals:
@@ -1789,6 +3812,20 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
         self.config.last_return_color = the_return_color
         return self.config.last_return_color
 
+    def _shorten_path(self, filename):
+        if self.config.shorten_path:
+            try:
+                home_dir = os.path.expanduser("~")
+                if (
+                    len(home_dir) > 4
+                    and filename.startswith(home_dir)
+                    and filename.count(home_dir) == 1
+                ):
+                    return filename.replace(home_dir, "~")
+            except Exception:
+                pass
+        return filename
+
     def _print_if_sticky(self):
         if self.sticky:
             if self.first_time_sticky:
@@ -1797,18 +3834,7 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
             frame, lineno = self.stack[self.curindex]
             filename = self.canonic(frame.f_code.co_filename)
             lno = Color.set(self.config.line_number_color, "%r" % lineno)
-            short_filename = filename
-            if self.config.shorten_path:
-                try:
-                    home_dir = os.path.expanduser("~")
-                    if (
-                        len(home_dir) > 4
-                        and filename.startswith(home_dir)
-                        and filename.count(home_dir) == 1
-                    ):
-                        short_filename = filename.replace(home_dir, "~")
-                except Exception:
-                    pass
+            short_filename = self._shorten_path(filename)
             fname = Color.set(self.config.filename_color, short_filename)
             fnln = None
             if not self.curindex:
@@ -1986,13 +4012,62 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
         self.print_current_stack_entry()
     do_trun = do_truncate
 
-    def print_stack_trace(self):
+    def print_stack_trace(self, items=None):
+        if items is None:
+            items = range(len(self.stack))
         try:
-            for frame_index, frame_lineno in enumerate(self.stack):
-                self.print_stack_entry(frame_lineno, frame_index=frame_index)
+            for item in items:
+                if isinstance(item, tuple):
+                    self._print_collapsed_frames(*item)
+                else:
+                    self.print_stack_entry(self.stack[item], frame_index=item)
         except KeyboardInterrupt:
             pass
 
+    def _print_collapsed_frames(self, first, last):
+        code = self.stack[first][0].f_code
+        span = "%d-%d" % (first, last)
+        name = code.co_name
+        if self.config.highlight:
+            span = Color.set(self.config.stack_color, span)
+            name = Color.set(self.config.filename_color, name)
+        print("[%s]   ... %s x%d" % (span, name, last - first + 1), file=self.stdout)
+
+    def _where_items(self, keep=(), threshold=None):
+        """Return the `where` entries: frame indexes, or (first, last) runs.
+
+        Runs of one function longer than `threshold` (default
+        `where_collapse_threshold`, 0 to never collapse) keep their
+        outermost, innermost and current frames (and those in `keep`);
+        the rest collapse into a (first, last) tuple.
+        """
+        if threshold is None:
+            threshold = self.config.where_collapse_threshold
+        stack = self.stack
+        shown = {self.curindex, *keep}
+        items = []
+        i = 0
+        while i < len(stack):
+            code = stack[i][0].f_code
+            j = i
+            while j + 1 < len(stack) and stack[j + 1][0].f_code is code:
+                j += 1
+            if threshold and j - i + 1 > threshold:
+                items.append(i)
+                k = i + 1
+                for index in sorted(x for x in shown if i < x < j):
+                    if k < index:
+                        items.append((k, index - 1))
+                    items.append(index)
+                    k = index + 1
+                if k < j:
+                    items.append((k, j - 1))
+                items.append(j)
+            else:
+                items.extend(range(i, j + 1))
+            i = j + 1
+        return items
+
     def print_stack_entry(
         self, frame_lineno, prompt_prefix=pdb.line_prefix, frame_index=None
     ):
@@ -2030,14 +4105,61 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
             print(file=self.stdout, end="\n\033[F")
 
     def preloop(self):
+        if getattr(getattr(self, "_vim_session", None), "dap", False):
+            self._dap_sync()
+        self._refresh_terminal_size()
+        self._publish_stop(notify=True)
         self._print_if_sticky()
+        if self.sticky and self.config.sticky_show_changed_locals:
+            self._print_changed_locals()
         display_list = self._get_display_list()
-        for expr, oldvalue in display_list.items():
-            newvalue = self._getval_or_undefined(expr)
-            if newvalue is not oldvalue or newvalue != oldvalue:
-                display_list[expr] = newvalue
-                print("%s: %r --> %r" % (expr, oldvalue, newvalue),
+        for expr, (oldprint, oldrepr) in display_list.items():
+            try:
+                newvalue = self._getval_or_undefined(expr)
+            except Exception:
+                continue
+            newprint = _fingerprint(newvalue, self.config)
+            if newprint != oldprint:
+                newrepr = _remote_repr.repr(newvalue)
+                display_list[expr] = newprint, newrepr
+                print("%s: %s --> %s" % (expr, oldrepr, newrepr),
                       file=self.stdout)
+        if self._profile is not None:
+            profile, self._profile = self._profile, None
+            self._print_profile(profile)
+        self.stdout.flush()
+
+    def _print_changed_locals(self):
+        frame = self.curframe
+        current = dict(itertools.islice(
+            frame.f_locals.items(), self.config.changed_locals_max_scan
+        ))
+        key = (id(frame), frame.f_code)
+        previous = self._locals_snapshot
+        self._locals_snapshot = key, current
+        if previous is None or previous[0] != key:
+            return
+        old = previous[1]
+        # Identity only: rebinding is detected, in-place mutation is not
+        changed = [
+            name for name, value in current.items()
+            if old.get(name, undefined) is not value and not name.startswith("__")
+        ]
+        if not changed:
+            return
+        limit = self.config.changed_locals_repr_limit
+        entries = []
+        for name in changed:
+            try:
+                value = _remote_repr.repr(current[name])
+            except Exception:
+                value = "(unprintable)"
+            if len(value) > limit:
+                value = value[:limit - 3] + "..."
+            if self.config.highlight:
+                name = Color.set(self.config.line_number_color, name)
+            entries.append(f"{name}={value}")
+        print(" changed: " + ", ".join(entries), file=self.stdout)
 
     def _get_position_of_arg(self, arg):
         try:
@@ -2132,13 +4254,146 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
     do_d = do_down
 
     def do_where(self, arg):
-        self.last_cmd = self.lastcmd = "where"
+        """ w(here) [+ | - | N | all]
+
+        Print a page of the stack trace around the current frame, the
+        next (+) or previous (-) page, the page holding frame N, or the
+        whole stack. With where_collapse_threshold set, long recursive
+        runs are collapsed, except in "where all".
+        """
+        arg = arg.strip()
+        self.last_cmd = self.lastcmd = "where " + arg if arg in ("+", "-") else "where"
         self.sticky = False
+        target = None
+        if arg and arg not in ("+", "-", "all"):
+            try:
+                target = int(arg)
+            except ValueError:
+                self.error("Usage: where [+ | - | N | all]")
+                return
+        if arg == "all":
+            print(file=self.stdout)
+            self.print_stack_trace(self._where_items(threshold=0))
+            return
+        items = self._where_items(keep=() if target is None else (target,))
+        size = self.config.where_page_size
         print(file=self.stdout)
-        self.print_stack_trace()
+        if not size or len(items) <= size:
+            self.print_stack_trace(items)
+            return
+
+        def _position(index):
+            for pos, item in enumerate(items):
+                last = item[1] if isinstance(item, tuple) else item
+                if last >= index:
+                    return pos
+            return len(items) - 1
+
+        if arg in ("+", "-") and self._where_start is not None:
+            start = self._where_start + (size if arg == "+" else -size)
+        elif target is not None:
+            start = _position(target) - size // 2
+        else:
+            start = _position(self.curindex) - size // 2
+        start = max(0, min(start, len(items) - size))
+        self._where_start = start
+        page = items[start:start + size]
+        first = page[0][0] if isinstance(page[0], tuple) else page[0]
+        last = page[-1][1] if isinstance(page[-1], tuple) else page[-1]
+        print("Frames %d-%d of %d (where +/- for more, where all)"
+              % (first, last, len(self.stack)), file=self.stdout)
+        self.print_stack_trace(page)
     do_w = do_where
     do_bt = do_where
 
+    def _task_state(self, task, current):
+        if task is current:
+            return "running"
+        if task.cancelled():
+            return "cancelled"
+        return "done" if task.done() else "pending"
+
+    def _task_stack(self, task):
+        """The frames of `task`, outermost first.
+
+        A suspended task's stack comes from asyncio. The running task's
+        is taken from this thread's stack, from its coroutine frame down,
+        so event loop frames are left out.
+        """
+        top = getattr(task.get_coro(), "cr_frame", None)
+        frames = [frame for frame, _ in self.stack]
+        if top is not None and top in frames:
+            return frames[frames.index(top):]
+        return task.get_stack(limit=None)
+
+    def do_tasks(self, arg):
+        """ tasks
+
+        List the tasks of the event loop running in this thread, with
+        the line each one is suspended at. The current task is marked
+        with a star. Use "task where N" to print the stack of task N.
+        """
+        loop = _running_loop()
+        if loop is None:
+            self.error("No event loop is running in this thread")
+            return
+        asyncio = sys.modules["asyncio"]
+        current = asyncio.current_task(loop)
+        self._task_list = sorted(asyncio.all_tasks(loop), key=_task_sort_key)
+        for index, task in enumerate(self._task_list):
+            marker = "*" if task is current else " "
+            colored_index = index
+            name = task.get_name()
+            if self.config.highlight:
+                colored_index = Color.set(self.config.stack_color, index)
+                name = Color.set(self.config.filename_color, name)
+            print("[%s]%s %s (%s)" % (colored_index, marker, name,
+                                      self._task_state(task, current)),
+                  file=self.stdout)
+            stack = self._task_stack(task)
+            if stack:
+                frame = stack[-1]
+                print("    " + self.format_stack_entry((frame, frame.f_lineno)),
+                      file=self.stdout)
+
+    def do_task(self, arg):
+        """ task where [N]
+
+        Print the coroutine stack of task N, as numbered by "tasks",
+        or of the current task.
+        """
+        command, _, number = arg.strip().partition(" ")
+        if command not in ("where", "w", "bt"):
+            self.error("Usage: task where [N]")
+            return
+        loop = _running_loop()
+        if loop is None:
+            self.error("No event loop is running in this thread")
+            return
+        asyncio = sys.modules["asyncio"]
+        current = asyncio.current_task(loop)
+        number = number.strip()
+        if not number:
+            task = current
+            if task is None:
+                self.error("Not running inside a task")
+                return
+        else:
+            try:
+                task = self._task_list[int(number)]
+            except (ValueError, IndexError):
+                self.error('No task "%s"; run "tasks" to number them' % number)
+                return
+        print("%s (%s)" % (task.get_name(), self._task_state(task, current)),
+              file=self.stdout)
+        for index, frame in enumerate(self._task_stack(task)):
+            colored_index = index
+            if self.config.highlight:
+                colored_index = Color.set(self.config.stack_color, index)
+            print("[%s]   %s" % (colored_index,
+                                 self.format_stack_entry((frame, frame.f_lineno))),
+                  file=self.stdout)
+
     def _open_editor(self, editor, lineno, filename):
         filename = filename.replace('"', '\\"')
         subprocess.call(editor.replace('<filename>', filename).replace('<lineno>', str(lineno)), shell=True, **self._choose_ext_stdio())
@@ -2151,8 +4406,13 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
 
     def do_edit(self, arg):
         "Open an editor visiting the current file at the current line"
+        match = re.match(r"(.+):(\d+)$", arg.strip())
         if arg == "":
             filename, lineno = self._get_current_position()
+        elif match and os.path.isfile(os.path.expanduser(match.group(1))):
+            # file:line, as printed by memdiff and profile
+            filename = os.path.abspath(os.path.expanduser(match.group(1)))
+            lineno = int(match.group(2))
         else:
             filename, lineno, _ = self._get_position_of_arg(arg)
             if filename is None:
@@ -2182,10 +4442,178 @@ class Pdb(pdb.Pdb, ConfigurableClass, threading.local, object):
         self._via_set_trace_frame = frame
         return super().set_trace(frame)
 
+    def break_here(self, frame):
+        if _item_watches:
+            for watch in list(_item_watches):
+                header = watch.check()
+                if header is not None:
+                    self.message(header)
+                    self.currentbp = 0
+                    return True
+        return super().break_here(frame)
+
+    def break_anywhere(self, frame):
+        # Without sys.monitoring, DAP sessions pick up new breakpoints on
+        # their next call
+        if _dap_server is not None and getattr(
+            self, "_dap_breakpoints_gen", _dap_breakpoints_gen
+        ) != _dap_breakpoints_gen:
+            self._dap_sync_running(frame)
+        # Item watches are checked per line, in the frames that can write
+        if _item_watches:
+            for watch in list(_item_watches):
+                if watch.reachable(frame):
+                    return True
+        return super().break_anywhere(frame)
+
+    def set_continue(self):
+        self._step_task = self._finish_user = None
+        self._disarm_until()
+        self._refresh_skip_state()
+        session = getattr(self, "_vim_session", None)
+        keep_calls = (session is not None and session.dap
+                      and not hasattr(sys, "monitoring"))
+        if _item_watches or keep_calls:
+            self._set_stopinfo(self.botframe, None, -1)
+            return
+        super().set_continue()
+
+    def _before_resume(self):
+        self._finish_user = None
+        self._disarm_until()
+        self._refresh_skip_state()
+        # Remember the task being stepped, so that other tasks run by the
+        # loop while it is suspended in an `await` do not stop the step.
+        self._step_task = None
+        if not self.config.skip_asyncio_internals:
+            return
+        loop = _running_loop()
+        if loop is not None:
+            task = sys.modules["asyncio"].current_task(loop)
+            if task is not None:
+                self._step_task = loop, task
+
+    def set_step(self):
+        self._before_resume()
+        super().set_step()
+
+    def set_next(self, frame):
+        self._before_resume()
+        super().set_next(frame)
+
+    def set_return(self, frame):
+        self._before_resume()
+        super().set_return(frame)
+
+    def set_until(self, frame, lineno=None):
+        self._before_resume()
+        super().set_until(frame, lineno)
+        if (
+            self.config.until_fast_forward
+            and not _item_watches
+            and frame.f_trace is not None
+            and not self.get_file_breaks(self.canonic(frame.f_code.co_filename))
+        ):
+            self._until_monitor = _UntilMonitor.arm(
+                self, frame, frame.f_lineno + 1 if lineno is None else lineno
+            )
+
+    def _disarm_until(self):
+        if self._until_monitor is not None:
+            self._until_monitor.disarm()
+            self._until_monitor = None
+
+    def stop_here(self, frame):
+        if self._step_task is not None:
+            loop, task = self._step_task
+            if (
+                not task.done()
+                and loop.is_running()
+                and sys.modules["asyncio"].current_task(loop) is not task
+            ):
+                return False
+        # Same as Bdb.stop_here, with the skip decision cached per code
+        if self._is_skipped_code(frame):
+            return False
+        if self._finish_user is not None and (
+            frame is self._finish_user or not self._is_user_code(frame)
+        ):
+            return False
+        if frame is self.stopframe:
+            if self.stoplineno == -1:
+                return False
+            return frame.f_lineno >= self.stoplineno
+        return not self.stopframe
+
+    def _refresh_skip_state(self):
+        # Options can only change at the prompt, so the cached decisions
+        # are checked once per resume rather than once per frame.
+        config = self.config
+        key = (
+            self.skip, config.skip_asyncio_internals, config.just_my_code,
+            tuple(config.user_source_roots),
+        )
+        if key != self._skip_key:
+            self._skip_key = key
+            self._skip_codes = _CodeCache()  # code --> skipped
+            self._skip_names = {}  # module name --> skipped
+            self._user_codes = _CodeCache()  # code --> user code
+            self._user_roots = tuple(
+                os.path.join(os.path.abspath(os.path.expanduser(root)), "")
+                for root in config.user_source_roots
+            )
+
+    def _is_user_code(self, frame):
+        """Whether `frame` runs code from `user_source_roots`.
+
+        Without roots, all code but the stdlib and installed packages is.
+        """
+        code = frame.f_code
+        codes = self._user_codes
+        try:
+            return codes[code]
+        except KeyError:
+            pass
+        if self._user_roots:
+            filename = code.co_filename
+            if filename.startswith("<"):
+                filename = frame.f_globals.get("__file__") or ""
+            user = bool(filename) and os.path.abspath(filename).startswith(
+                self._user_roots
+            )
+        else:
+            user = not _is_library_code(code, frame.f_globals)
+        codes[code] = user
+        return user
+
+    def _is_skipped_code(self, frame):
+        code = frame.f_code
+        codes = self._skip_codes
+        try:
+            return codes[code]
+        except KeyError:
+            pass
+        skipped = (
+            self.config.just_my_code and not self._is_user_code(frame)
+        ) or self.is_skipped_module(frame.f_globals.get("__name__"))
+        codes[code] = skipped
+        return skipped
+
     def is_skipped_module(self, module_name):
         if module_name is None:
             return False
-        return super().is_skipped_module(module_name)
+        names = self._skip_names
+        try:
+            return names[module_name]
+        except KeyError:
+            pass
+        skipped = bool(
+            self.config.skip_asyncio_internals
+            and module_name.partition(".")[0] in _ASYNCIO_INTERNALS
+            or self.skip and _skip_regex(frozenset(self.skip)).match(module_name)
+        )
+        names[module_name] = skipped
+        return skipped
 
     def error(self, msg):
         """Override/enhance default error method to display tracebacks."""
@@ -2243,6 +4671,296 @@ def post_mortem(t=None, Pdb=Pdb):
     p.interaction(None, t)
 
 
+_SNAPSHOT_MAGIC = b"PDBPSNAP\x01"
+
+
+def _snapshot_section(obj):
+    return zlib.compress(json.dumps(obj).encode(), 6)
+
+
+class _PickleTooLarge(Exception):
+    pass
+
+
+class _BoundedBuffer(io.BytesIO):
+    """Pickler output that gives up once `limit` bytes are exceeded."""
+
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+
+    def write(self, data):
+        if self.tell() + len(data) > self.limit:
+            raise _PickleTooLarge
+        return super().write(data)
+
+
+def _snapshot_pickle(value, limit):
+    # sys.getsizeof counts the buffer of arrays and bytes-like objects and
+    # the slots of containers, so most large values are never pickled.
+    try:
+        if sys.getsizeof(value) > limit:
+            return None
+        buffer = _BoundedBuffer(limit)
+        pickle.Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(value)
+    except Exception:
+        return None
+    return buffer.getvalue()
+
+
+def _snapshot_locals(frame, config):
+    result = {}
+    for name, value in frame.f_locals.items():
+        if name == "__builtins__":
+            continue
+        entry = {"type": type(value).__name__}
+        try:
+            entry["repr"] = _remote_repr.repr(value)
+        except Exception:
+            entry["repr"] = "(unprintable %s)" % entry["type"]
+        data = _snapshot_pickle(value, config.snapshot_pickle_limit)
+        if data is not None:
+            entry["pickle"] = base64.b64encode(data).decode()
+        result[name] = entry
+    return result
+
+
+def _snapshot_source(frame, lineno, config):
+    # The whole function, or a window around module-level code
+    try:
+        if frame.f_code.co_name == "<module>":
+            raise TypeError
+        lines, start = inspect.getsourcelines(frame)
+        return max(start, 1), lines
+    except (OSError, TypeError, IndexError):
+        import linecache
+        lines = linecache.getlines(frame.f_code.co_filename, frame.f_globals)
+        context = config.snapshot_source_context
+        start = max(lineno - context, 1)
+        return start, lines[start - 1:lineno + context]
+
+
+def dump_post_mortem(path, t=None, config=DefaultConfig):
+    """Write the traceback `t` (default: the one being handled) to `path`.
+
+    The file holds a compressed index followed by one section per frame
+    (locations and locals) and per source file (windows around the
+    frames). Locals are saved as a bounded repr, plus a pickle when they
+    can be pickled. Open it with `python -m pdbp --load=<path> [--unpickle]`.
+    """
+    if isinstance(t, BaseException):
+        exc = t
+        t = t.__traceback__
+    else:
+        exc = sys.exc_info()[1]
+        if t is None:
+            t = sys.exc_info()[2]
+    if t is None:
+        raise ValueError("dump_post_mortem outside of exception context")
+    sections = []
+    offset = 0
+
+    def _add(data):
+        nonlocal offset
+        sections.append(data)
+        offset += len(data)
+        return [offset - len(data), len(data)]
+
+    frames = []
+    windows = {}
+    while t is not None:
+        frame, lineno = t.tb_frame, t.tb_lineno
+        start, lines = _snapshot_source(frame, lineno, config)
+        windows.setdefault(frame.f_code.co_filename, {}).update(
+            (start + i, line) for i, line in enumerate(lines)
+        )
+        frames.append({
+            "filename": frame.f_code.co_filename,
+            "name": frame.f_code.co_name,
+            "module": frame.f_globals.get("__name__"),
+            "lineno": lineno,
+            "source": [start, start + len(lines)],
+            "section": _add(
+                _snapshot_section(_snapshot_locals(frame, config))
+            ),
+        })
+        t = t.tb_next
+    sources = {
+        filename: _add(_snapshot_section(sorted(window.items())))
+        for filename, window in windows.items()
+    }
+    index = {
+        "version": 1,
+        "python": sys.version.split()[0],
+        "time": time.time(),
+        "exception": "".join(
+            traceback.format_exception_only(type(exc), exc)
+        ).strip() if exc else "",
+        "frames": frames,
+        "sources": sources,
+    }
+    header = _snapshot_section(index)
+    with open(path, "wb") as f:
+        f.write(_SNAPSHOT_MAGIC)
+        f.write(_FRAME_HEADER.pack(len(header)))
+        f.write(header)
+        for data in sections:
+            f.write(data)
+    return path
+
+
+class _SnapshotValue:
+    # A local that was not (or is not to be) unpickled, shown as it was
+    # at dump time
+    def __init__(self, entry):
+        self._repr = entry["repr"]
+        self._type = entry["type"]
+
+    def __repr__(self):
+        return self._repr
+
+
+class _SnapshotCode:
+    def __init__(self, info):
+        self.co_filename = info["filename"]
+        self.co_name = info["name"]
+        self.co_firstlineno = info["source"][0]
+        self.co_consts = self.co_varnames = ()
+        self.co_cellvars = self.co_names = ()
+        self._lineno = info["lineno"]
+
+    def co_lines(self):
+        yield 0, 2, self._lineno
+
+
+class _SnapshotFrame:
+    """Stand-in for a frame of a snapshot; locals load on first access."""
+
+    f_lasti = 0
+    f_trace = None
+
+    def __init__(self, snapshot, info, back):
+        self._snapshot = snapshot
+        self._info = info
+        self._locals = None
+        self.f_code = _SnapshotCode(info)
+        self.f_lineno = info["lineno"]
+        self.f_back = back
+        self.f_globals = {
+            "__name__": info["module"], "__builtins__": __builtins__,
+        }
+
+    @property
+    def f_locals(self):
+        if self._locals is None:
+            self._locals = self._snapshot.load_locals(self._info)
+        return self._locals
+
+
+class _SnapshotTraceback:
+    tb_lasti = 0
+
+    def __init__(self, frame, tb_next):
+        self.tb_frame = frame
+        self.tb_lineno = frame.f_lineno
+        self.tb_next = tb_next
+
+
+class _Snapshot:
+    def __init__(self, path, unpickle=False):
+        import linecache
+        self.unpickle = unpickle
+        self.file = open(path, "rb")
+        if self.file.read(len(_SNAPSHOT_MAGIC)) != _SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a Pdb+ snapshot")
+        (size,) = _FRAME_HEADER.unpack(self.file.read(_FRAME_HEADER.size))
+        self.index = json.loads(zlib.decompress(self.file.read(size)))
+        self.base = self.file.tell()
+        for filename, section in self.index["sources"].items():
+            lines = []
+            for lineno, line in self._read(section):
+                lines.extend(["\n"] * (lineno - 1 - len(lines)))
+                lines.append(line)
+            # No mtime: linecache.checkcache leaves the entry alone
+            linecache.cache[filename] = (
+                sum(map(len, lines)), None, lines, filename
+            )
+        tb = None
+        frames = []
+        back = None
+        for info in self.index["frames"]:
+            back = _SnapshotFrame(self, info, back)
+            frames.append(back)
+        for frame in reversed(frames):
+            tb = _SnapshotTraceback(frame, tb)
+        self.traceback = tb
+
+    def _read(self, section):
+        offset, length = section
+        self.file.seek(self.base + offset)
+        return json.loads(zlib.decompress(self.file.read(length)))
+
+    def load_locals(self, info):
+        result = {}
+        for name, entry in self._read(info["section"]).items():
+            value = _SnapshotValue(entry)
+            # Unpickling runs code from the file: only when asked to
+            if self.unpickle and "pickle" in entry:
+                try:
+                    value = pickle.loads(base64.b64decode(entry["pickle"]))
+                except Exception:
+                    pass
+            result[name] = value
+        return result
+
+
+class _SnapshotPdb(Pdb):
+    """Read-only Pdb+ over a snapshot written by `dump_post_mortem`."""
+
+    def _findsource(self, frame):
+        return self._getsourcelines(frame)[0], 0
+
+    def _getsourcelines(self, frame):
+        import linecache
+        if not isinstance(frame, _SnapshotFrame):
+            return super()._getsourcelines(frame)
+        start, end = frame._info["source"]
+        lines = linecache.getlines(frame.f_code.co_filename)
+        if frame.f_code.co_name == "<module>":
+            return lines, 1
+        return lines[start - 1:end - 1], start
+
+    def _not_in_snapshot(self, arg):
+        self.error("Not available when inspecting a snapshot")
+
+    do_step = do_s = do_next = do_n = do_until = do_unt = _not_in_snapshot
+    do_return = do_r = do_jump = do_j = do_run = do_restart = _not_in_snapshot
+    do_debug = do_finish_user = do_fu = do_profile = _not_in_snapshot
+
+    def do_continue(self, arg):
+        return 1
+
+    do_c = do_cont = do_continue
+
+
+def load_post_mortem(path, unpickle=False):
+    """Open a read-only Pdb+ session over a `dump_post_mortem` file.
+
+    Locals are shown as the repr saved at dump time. With `unpickle`, the
+    pickled ones are restored as objects, which runs code from the file:
+    only use it for snapshots you trust.
+    """
+    snapshot = _Snapshot(path, unpickle)
+    index = snapshot.index
+    when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(index["time"]))
+    print(f"Snapshot {path} (Python {index['python']}, {when})")
+    if index["exception"]:
+        print(index["exception"])
+    p = _SnapshotPdb()
+    p.reset()
+    p.interaction(None, snapshot.traceback)
+
+
 GLOBAL_PDB = None
 
 
@@ -2294,6 +5012,111 @@ def xpm(Pdb=Pdb):
     post_mortem(info[2], Pdb)
 
 
+def _set_trace_if_idle(frame):
+    """set_trace(frame), unless `_pdb_lock` is already held.
+
+    The lock is not reentrant: a signal handler that runs while its
+    thread is inside set_trace would otherwise deadlock.
+    """
+    if not _pdb_lock.acquire(blocking=False):
+        return False
+    _pdb_lock.release()
+    set_trace(frame)
+    return True
+
+
+def _call_in_thread(thread_id, key, func):
+    """Run `func(frame)` on the thread `thread_id` (an ident) at its next line.
+
+    The thread is not traced before that. It is reached through a
+    sys.monitoring LINE callback (Python 3.12+), so the tracers of other
+    threads are left alone. A `func` that returns False is retried on the
+    following line. Does nothing if a call with the same `key` is already
+    pending for the thread, or if no monitoring tool id is free.
+    """
+    global _thread_calls_tool
+    monitoring = getattr(sys, "monitoring", None)
+    if monitoring is None:
+        raise RuntimeError("Reaching a running thread requires Python 3.12+")
+    if thread_id not in sys._current_frames():
+        raise ValueError(f"No running thread with ident {thread_id}")
+    with _thread_calls_lock:
+        if _thread_calls_tool is None:
+            for tool in (monitoring.DEBUGGER_ID, 3, 4):
+                try:
+                    monitoring.use_tool_id(tool, "pdbp")
+                except ValueError:
+                    continue
+                break
+            else:
+                return
+            monitoring.register_callback(
+                tool, monitoring.events.LINE, _thread_calls_line
+            )
+            monitoring.set_events(tool, monitoring.events.LINE)
+            _thread_calls_tool = tool
+        _thread_calls.setdefault(thread_id, {}).setdefault(key, func)
+
+
+def _thread_calls_line(code, line):
+    global _thread_calls_tool
+    thread_id = threading.get_ident()
+    if thread_id not in _thread_calls:
+        return None
+    monitoring = sys.monitoring
+    with _thread_calls_lock:
+        calls = _thread_calls.pop(thread_id, {})
+        if not _thread_calls and _thread_calls_tool is not None:
+            tool, _thread_calls_tool = _thread_calls_tool, None
+            monitoring.set_events(tool, 0)
+            monitoring.register_callback(tool, monitoring.events.LINE, None)
+            monitoring.free_tool_id(tool)
+    frame = sys._getframe(1)
+    for key, func in calls.items():
+        if func(frame) is False:
+            _call_in_thread(thread_id, key, func)
+    return None
+
+
+def _break_in_thread(thread_id):
+    """Stop the thread `thread_id` (an ident) at its next line.
+
+    See `_call_in_thread`. Retried on the next line while another thread
+    holds `_pdb_lock`.
+    """
+    _call_in_thread(thread_id, "break", _set_trace_if_idle)
+
+
+def install_signal_attach(sig=signal.SIGUSR1, thread=None):
+    """Break into Pdb+ when the process receives `sig`.
+
+    Nothing is traced until the signal arrives. The stopped thread then
+    gets a debugger session through the usual PTY or remote path. `thread`
+    (a `threading.Thread` or ident) defaults to the main thread. Must be
+    called from the main thread. Returns the previous signal handler.
+    A signal that arrives while the debugger is being entered, or after
+    the thread has exited, is ignored.
+    """
+    thread_id = getattr(thread, "ident", thread)
+    main = thread_id is None or thread_id == threading.main_thread().ident
+    # Checked here: raised from the handler, it would hit whatever line
+    # the main thread is running
+    if not main and not hasattr(sys, "monitoring"):
+        raise RuntimeError("Stopping a non-main thread requires Python 3.12+")
+
+    def _handler(signum, frame):
+        if main:
+            # Signal handlers run as pending calls of the main thread
+            _set_trace_if_idle(frame)
+            return
+        try:
+            _break_in_thread(thread_id)
+        except ValueError:
+            pass  # The thread has exited
+
+    return signal.signal(sig, _handler)
+
+
 def enable():
     global set_trace
     set_trace = enable.set_trace
@@ -2319,6 +5142,26 @@ set_tracex._dont_inline_ = True
 _HIDE_FRAME = object()
 
 
+_hide_info_cache = _CodeCache()
+
+
+def _code_hide_info(code):
+    """Return (decorated with hideframe, may set __tracebackhide__ locally)."""
+    try:
+        return _hide_info_cache[code]
+    except KeyError:
+        pass
+    consts = code.co_consts
+    info = (
+        bool(consts) and consts[-1] is _HIDE_FRAME,
+        "__tracebackhide__" in code.co_varnames
+        or "__tracebackhide__" in code.co_cellvars
+        or "__tracebackhide__" in code.co_names,
+    )
+    _hide_info_cache[code] = info
+    return info
+
+
 def hideframe(func):
     c = func.__code__
     new_co_consts = c.co_consts + (_HIDE_FRAME,)
@@ -2341,20 +5184,263 @@ def always(obj, value):
     return True
 
 
+_watches = {}
+_watch_ids = itertools.count(1)
+_item_watches = []
+_watch_lock = threading.Lock()
+
+
+def _watch_stop(frame, header, Pdb=Pdb):
+    # Writes made from the Pdb+ prompt itself never stop again
+    if getattr(_interacting, "active", False):
+        return
+    set_trace(frame, header=header, Pdb=Pdb)
+
+
+def _watch_header(num, desc, old, new):
+    return f"Watchpoint {num}: {desc}: {_remote_repr.repr(old)} -> {_remote_repr.repr(new)}"
+
+
+class _WatchedAttr:
+    """Data descriptor standing in for one watched attribute of a class.
+
+    Only writes to this attribute go through Python code; the rest of the
+    class is untouched. Values keep living where they lived before: in the
+    instance `__dict__`, or in the descriptor (slot, property) it replaces.
+    """
+
+    def __init__(self, cls, name):
+        self.cls = cls
+        self.name = name
+        # What `uninstall` puts back
+        self.own = cls.__dict__.get(name, undefined)
+        # What attribute access resolved to, possibly through a base class
+        # (an inherited property or slot must keep handling the writes)
+        self.inner = undefined
+        for base in cls.__mro__:
+            if name in base.__dict__:
+                self.inner = base.__dict__[name]
+                break
+        self.inner_is_data = hasattr(type(self.inner), "__set__")
+        self.watches = []
+
+    def _class_value(self, obj, objtype):
+        inner = self.inner
+        if inner is undefined:
+            raise AttributeError(
+                f"{self.cls.__name__!r} object has no attribute {self.name!r}"
+            )
+        if hasattr(type(inner), "__get__"):
+            return inner.__get__(obj, objtype)
+        return inner
+
+    def __get__(self, obj, objtype=None):
+        if obj is None or self.inner_is_data:
+            return self._class_value(obj, objtype)
+        try:
+            return obj.__dict__[self.name]
+        except KeyError:
+            return self._class_value(obj, objtype)
+
+    def _matching(self, obj):
+        return [w for w in self.watches if w.matches(obj)]
+
+    def _old_value(self, obj):
+        try:
+            return self.__get__(obj, type(obj))
+        except AttributeError:
+            return undefined
+
+    def __set__(self, obj, value):
+        matching = self._matching(obj)
+        if matching:
+            old = self._old_value(obj)
+        if self.inner_is_data:
+            self.inner.__set__(obj, value)
+        else:
+            obj.__dict__[self.name] = value
+        if matching:
+            self._fire(matching, obj, old, value)
+
+    def __delete__(self, obj):
+        matching = self._matching(obj)
+        if matching:
+            old = self._old_value(obj)
+        if self.inner_is_data:
+            self.inner.__delete__(obj)
+        else:
+            try:
+                del obj.__dict__[self.name]
+            except KeyError:
+                raise AttributeError(self.name) from None
+        if matching:
+            self._fire(matching, obj, old, undefined)
+
+    def _fire(self, matching, obj, old, new):
+        for watch in matching:
+            if watch.condition(obj, old, new):
+                watch.hits += 1
+                # Called from __set__/__delete__, so two frames up is the writer
+                header = _watch_header(watch.num, watch.desc, old, new)
+                _watch_stop(sys._getframe(2), header, watch.pdb_cls)
+                return
+
+    def uninstall(self):
+        if self.own is undefined:
+            delattr(self.cls, self.name)
+        else:
+            setattr(self.cls, self.name, self.own)
+
+
+class _AttrWatch:
+    def __init__(self, num, target, name, condition, pdb_cls=Pdb):
+        cls = target if isinstance(target, type) else type(target)
+        descr = cls.__dict__.get(name)
+        if not isinstance(descr, _WatchedAttr):
+            descr = _WatchedAttr(cls, name)
+            setattr(cls, name, descr)
+        self.num = num
+        self.descr = descr
+        self.condition = condition
+        self.pdb_cls = pdb_cls
+        self.hits = 0
+        if target is cls:
+            self.target_id = None
+            self.desc = f"{cls.__qualname__}.{name}"
+        else:
+            # Hold the instance itself when it cannot be weakly referenced,
+            # so its id stays unique while the watch exists.
+            self.target_id = id(target)
+            try:
+                self.target_ref = weakref.ref(target)
+            except TypeError:
+                self.target_ref = target
+            self.desc = f"<{cls.__qualname__} at {id(target):#x}>.{name}"
+        descr.watches.append(self)
+
+    def matches(self, obj):
+        return self.target_id is None or self.target_id == id(obj)
+
+    def remove(self):
+        self.descr.watches.remove(self)
+        if not self.descr.watches:
+            self.descr.uninstall()
+
+
+class _ItemWatch:
+    """Watch of `container[key]`, compared at each traced line.
+
+    Writes to dicts and lists cannot be intercepted without replacing the
+    container, so the check runs from the tracing Pdb+ and only while item
+    watches exist. Only frames that can name the container get their lines
+    traced; other code pays for its call events alone.
+    """
+
+    def __init__(self, num, container, key, condition):
+        self.num = num
+        self.container = container
+        self.key = key
+        self.condition = condition
+        self.hits = 0
+        self.old = self.current()
+        self.desc = f"<{type(container).__qualname__} at {id(container):#x}>[{key!r}]"
+        _item_watches.append(self)
+
+    def reachable(self, frame):
+        """Whether the code of `frame` can name the container.
+
+        It must be a local, or a global the code refers to, or one of
+        their attributes named in the code (`self.cache`, `mod.table`).
+        """
+        names = frame.f_code.co_names
+        f_globals = frame.f_globals
+        values = [f_globals[name] for name in names if name in f_globals]
+        values += frame.f_locals.values()
+        target = self.container
+        for value in values:
+            if value is target:
+                return True
+            # Plain values have no __dict__, skip them without an exception
+            if type(value).__dictoffset__:
+                try:
+                    attrs = object.__getattribute__(value, "__dict__")
+                except Exception:
+                    continue
+                for name in names:
+                    if attrs.get(name) is target:
+                        return True
+        return False
+
+    def current(self):
+        try:
+            return self.container[self.key]
+        except (LookupError, TypeError):
+            return undefined
+
+    def check(self):
+        new = self.current()
+        old = self.old
+        if new is old:
+            return None
+        self.old = new
+        if not self.condition(self.container, old, new):
+            return None
+        self.hits += 1
+        return _watch_header(self.num, self.desc, old, new)
+
+    def remove(self):
+        _item_watches.remove(self)
+
+
+def _watch_condition(condition):
+    return condition if condition is not None else (lambda obj, old, new: True)
+
+
+def watch_attr(target, name, condition=None, Pdb=Pdb):
+    """Stop whenever attribute `name` of `target` is set or deleted.
+
+    `target` is an instance, or a class to watch all of its instances.
+    `condition(obj, old, new)` filters the stops. `Pdb` is the debugger
+    class started by the first stop, as for `set_trace`. Returns the
+    watch number.
+    """
+    with _watch_lock:
+        num = next(_watch_ids)
+        _watches[num] = _AttrWatch(
+            num, target, name, _watch_condition(condition), Pdb
+        )
+    return num
+
+
+def watch_item(container, key, condition=None):
+    """Stop on the line after `container[key]` is rebound or removed.
+
+    `condition(container, old, new)` filters the stops. Returns the watch
+    number. While item watches exist, every call is traced, and so is every
+    line of a function that names the container. A write from a function
+    that gets the container some other way (as a call's return value) is
+    reported at the next traced line.
+    """
+    with _watch_lock:
+        num = next(_watch_ids)
+        _watches[num] = _ItemWatch(num, container, key, _watch_condition(condition))
+    return num
+
+
+def unwatch(num):
+    with _watch_lock:
+        watch = _watches.pop(num, None)
+        if watch is None:
+            print(f"The watchpoint {num} does not exist")
+            return
+        watch.remove()
+
+
 def break_on_setattr(attrname, condition=always, Pdb=Pdb):
     def decorator(cls):
-        old___setattr__ = cls.__setattr__
-
-        @hideframe
-        def __setattr__(self, attr, value):
-            if attr == attrname and condition(self, value):
-                frame = sys._getframe().f_back
-                pdb_ = Pdb()
-                pdb_.set_trace(frame)
-                pdb_.stopframe = frame
-                pdb_.interaction(frame, None)
-            old___setattr__(self, attr, value)
-        cls.__setattr__ = __setattr__
+        watch_attr(
+            cls, attrname, lambda obj, old, new: condition(obj, new), Pdb=Pdb
+        )
         return cls
     return decorator
 
@@ -2384,11 +5470,29 @@ pdb.set_none = set_none
 pdb.inject_debug = inject_debug
 pdb.remove_debug = remove_debug
 pdb.show_debug = show_debug
+pdb.enable_debug = enable_debug
+pdb.disable_debug = disable_debug
+pdb.inject_debug_pattern = inject_debug_pattern
+pdb.remove_debug_pattern = remove_debug_pattern
+pdb.install_signal_attach = install_signal_attach
+pdb.watch_attr = watch_attr
+pdb.watch_item = watch_item
+pdb.unwatch = unwatch
+pdb.dump_post_mortem = dump_post_mortem
+pdb.load_post_mortem = load_post_mortem
 
 
 def main():
     import getopt
-    opts, args = getopt.getopt(sys.argv[1:], "mhc:", ["help", "command="])
+    opts, args = getopt.getopt(
+        sys.argv[1:], "mhc:", ["help", "command=", "load=", "unpickle"]
+    )
+    for opt, optarg in opts:
+        if opt == "--load":
+            # A snapshot is inspected right here, not through a PTY
+            os.environ["_PDB_DISABLE_PTY"] = "1"
+            load_post_mortem(optarg, unpickle=("--unpickle", "") in opts)
+            return
     if not args:
         print(_usage)
         sys.exit(2)
@@ -0,0 +1,48 @@
+# Shared helpers of the benchmark scripts in this directory.
+import io
+import os
+import subprocess
+import sys
+import timeit
+
+
+def is_target():
+    """Whether this process was started by spawn_target()."""
+    return sys.argv[1:2] == ["--target"]
+
+
+# Keep the current stdio instead of waiting for a PTY client, except in
+# the processes started by spawn_target()
+if not is_target():
+    os.environ.setdefault("_PDB_DISABLE_PTY", "1")
+
+
+def arg(index, default, convert=int):
+    """Command line argument `index`, or `default`."""
+    return convert(sys.argv[index]) if len(sys.argv) > index else default
+
+
+def best(func, number, repeat=5):
+    """Best time of `func` over `repeat` runs, in seconds per call."""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def report(label, seconds, unit="ns", what="call"):
+    scale = {"ns": 1e9, "us": 1e6, "ms": 1e3}[unit]
+    print(f"{label:>14}: {seconds * scale:8.1f} {unit}/{what}")
+
+
+def quiet_pdb(**kwds):
+    """A Pdb+ instance that writes to a StringIO."""
+    import pdbp
+    return pdbp.Pdb(stdout=io.StringIO(), **kwds)
+
+
+def spawn_target(script, *args):
+    """Run `script --target *args` with PTYs enabled, output piped."""
+    env = dict(os.environ)
+    env.pop("_PDB_DISABLE_PTY", None)
+    return subprocess.Popen(
+        [sys.executable, script, "--target", *map(str, args)],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env,
+    )
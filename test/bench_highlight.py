@@ -0,0 +1,28 @@
+# format_source with the tokenize highlighter vs Pygments.
+#
+#   python test/bench_highlight.py [LINES]
+import re
+
+from _bench import arg, best, quiet_pdb, report
+
+import pdbp
+
+_escape = re.compile(r"\x1b\[[0-9;]*m")
+
+
+def main(lines):
+    with open(pdbp.__file__) as f:
+        src = "".join(f.readlines()[:lines])
+    p = quiet_pdb()
+    outputs = {}
+    for highlighter in ("pygments", "tokenize"):
+        p.config.highlighter = highlighter
+        outputs[highlighter] = p.format_source(src)
+        seconds = best(lambda: p.format_source(src), 10)
+        report(highlighter, seconds, "ms", f"{lines} lines")
+    plain = {name: _escape.sub("", text) for name, text in outputs.items()}
+    print("same text without escapes:", plain["pygments"] == plain["tokenize"])
+
+
+if __name__ == "__main__":
+    main(arg(1, 400))
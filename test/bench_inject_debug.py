@@ -0,0 +1,34 @@
+# Per-call overhead of inject_debug hooks that do not fire.
+#
+#   python test/bench_inject_debug.py [N]
+import types
+
+from _bench import arg, best, report
+
+import pdbp
+
+
+def target(x):
+    return x
+
+
+def main(n):
+    ns = types.SimpleNamespace(target=target)
+
+    def run(label):
+        call = ns.target
+        report(label, best(lambda: call(1), n))
+
+    run("plain")
+    hook = pdbp.inject_debug(ns, "target", every=n * 10)
+    run("sampled")
+    pdbp.disable_debug(hook)
+    run("disabled")
+    pdbp.remove_debug(hook)
+    hook = pdbp.inject_debug(ns, "target", condition=lambda x: x < 0)
+    run("condition")
+    pdbp.remove_debug(hook)
+
+
+if __name__ == "__main__":
+    main(arg(1, 200000))
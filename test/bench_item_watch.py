@@ -0,0 +1,67 @@
+# Cost of running code while an item watch is active, after `continue`.
+#
+#   python test/bench_item_watch.py [N]
+#
+# Code that cannot name the watched container only pays for its call
+# events; a function that names it is traced line by line.
+import sys
+
+import _bench
+from _bench import arg, best, report
+
+import pdbp
+
+table = {"x": 0}
+
+
+def helper(i):
+    return i * 2
+
+
+def unrelated(n):
+    total = 0
+    for i in range(n):
+        total += helper(i)
+    return total
+
+
+def naming(n):
+    total = 0
+    for i in range(n):
+        total += helper(i) + table["x"]
+    return total
+
+
+class ContinuingPdb(pdbp.Pdb):
+    def interaction(self, frame, traceback):
+        self.set_continue()
+
+
+def per_iteration(label, func, n):
+    report(label, best(lambda: func(n), 10) / n, what="iteration")
+
+
+def main(n):
+    per_iteration("untraced", unrelated, n)
+
+    # For scale: a breakpoint in another file also traces every call
+    pdbp.set_trace(Pdb=ContinuingPdb)
+    pdb = pdbp.GLOBAL_PDB
+    pdb.set_break(_bench.__file__, _bench.arg.__code__.co_firstlineno + 2)
+    pdbp.set_trace()
+    per_iteration("breakpoint", unrelated, n)
+    pdb.clear_all_breaks()
+    sys.settrace(None)
+
+    num = pdbp.watch_item(table, "x")
+    pdbp.set_trace(Pdb=ContinuingPdb)
+    try:
+        per_iteration("item watch", unrelated, n)
+        per_iteration("naming table", naming, n)
+    finally:
+        sys.settrace(None)
+        pdbp.unwatch(num)
+
+
+if __name__ == "__main__":
+    main(arg(1, 10000))
@@ -0,0 +1,49 @@
+# Render time of `list` and `ll` for a long function, per highlighter.
+#
+#   python test/bench_list_render.py [LINES]
+import importlib.util
+import io
+import os
+import tempfile
+
+from _bench import arg, best, quiet_pdb, report
+
+
+def long_function(lines):
+    body = "".join(
+        f"    value_{i} = {{'key': [{i}, {i} * 2, 'text {i}']}}"
+        f"  # line {i}\n"
+        for i in range(lines)
+    )
+    return (
+        "import sys\n\ndef long_function():\n"
+        + body
+        + "    return sys._getframe()\n"
+    )
+
+
+def main(lines):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "long_module.py")
+        with open(path, "w") as f:
+            f.write(long_function(lines))
+        spec = importlib.util.spec_from_file_location("long_module", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        frame = module.long_function()
+
+        p = quiet_pdb()
+        p.reset()
+        p.setup(frame, None)
+        for highlighter in ("pygments", "tokenize"):
+            p.config.highlighter = highlighter
+            for command in ("list", "ll"):
+                def render():
+                    p.stdout = io.StringIO()
+                    p.onecmd(command)
+                seconds = best(render, 10)
+                report(f"{highlighter} {command}", seconds, "ms", "render")
+
+
+if __name__ == "__main__":
+    main(arg(1, 150))
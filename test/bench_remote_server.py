@@ -0,0 +1,108 @@
+# Attach latency and request throughput of the remote debugging server.
+#
+#   python test/bench_remote_server.py [thread|asyncio] [N]
+#
+# Starts a target process with N threads stopped in pdbp.set_trace(), then
+# N fake clients that each attach a PTY and pipeline `sessions` requests.
+import json
+import os
+import pty
+import re
+import socket
+import struct
+import threading
+import time
+
+from _bench import arg, is_target, spawn_target
+
+_HEADER = struct.Struct("!I")
+_REQUESTS = 2000
+
+
+def target(mode, n):
+    import pdbp
+    pdbp.DefaultConfig.serve_mode = mode
+
+    def work(i):
+        total = i
+        pdbp.set_trace()
+        return total
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def encode(obj):
+    data = json.dumps(obj).encode()
+    return _HEADER.pack(len(data)) + data
+
+
+def recv(f):
+    size, = _HEADER.unpack(f.read(_HEADER.size))
+    return json.loads(f.read(size))
+
+
+def recv_reply(f):
+    # Id 0 is a pushed event
+    reply = recv(f)
+    while reply[0] == 0:
+        reply = recv(f)
+    return reply
+
+
+def hammer(sock, f, elapsed):
+    start = time.perf_counter()
+    sock.sendall(b"".join(
+        encode([i + 1, "sessions"]) for i in range(_REQUESTS)
+    ))
+    for _ in range(_REQUESTS):
+        recv_reply(f)
+    elapsed.append(time.perf_counter() - start)
+
+
+def main(mode, n):
+    proc = spawn_target(__file__, mode, n)
+    try:
+        line = proc.stdout.readline().decode()
+        host, port = re.search(r"Listen on (.*):(\d+)", line).groups()
+        ttys = [pty.openpty() for _ in range(n)]
+        latencies, conns = [], []
+        for _, slave in ttys:
+            while "Wait for a PTY" not in proc.stdout.readline().decode():
+                pass
+            sock = socket.create_connection((host, int(port)))
+            f = sock.makefile("rb")
+            start = time.perf_counter()
+            sock.sendall(encode([1, "attach", {"tty": os.ttyname(slave)}]))
+            assert recv_reply(f)[1] == "accepted"
+            latencies.append((time.perf_counter() - start) * 1000)
+            conns.append((sock, f))
+        print(f"{mode}: attach avg {sum(latencies) / n:.2f}ms,"
+              f" max {max(latencies):.2f}ms")
+
+        time.sleep(1)
+        elapsed = []
+        threads = [
+            threading.Thread(target=hammer, args=(s, f, elapsed))
+            for s, f in conns
+        ]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        rate = n * _REQUESTS / (time.perf_counter() - start)
+        print(f"{mode}: {rate:.0f} msgs/s over {n} clients")
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+if __name__ == "__main__":
+    if is_target():
+        target(arg(2, "thread", str), arg(3, 8))
+    else:
+        main(arg(1, "thread", str), arg(2, 8))
@@ -0,0 +1,23 @@
+# Cost of writing through the thread-local stdio proxy vs the raw stream.
+#
+#   python test/bench_stdio_proxy.py [N]
+import os
+
+from _bench import arg, best, report
+
+import pdbp
+
+
+def main(n):
+    raw = open(os.devnull, "w")
+    proxy = pdbp._TLocalTextIOWrapper(raw, raw)
+    line = "x" * 40 + "\n"
+    for name, stream in (("raw", raw), ("proxy", proxy)):
+        # The attribute is looked up per call, as print() does
+        report(name, best(lambda: stream.write(line), n), what="write")
+    # Methods that are not bound per thread go through __getattr__
+    report("proxy.writable", best(lambda: proxy.writable(), n))
+
+
+if __name__ == "__main__":
+    main(arg(1, 200000))
@@ -0,0 +1,172 @@
+# Scripted Debug Adapter Protocol client for the `dap_port` server.
+#
+#   python test/dap_client.py
+#
+# Runs a target with one thread stopped in pdbp.set_trace(), then drives
+# threads, stackTrace, scopes/variables, evaluate, next and continue.
+# Once the thread runs again, checks that evaluate is refused and sets a
+# breakpoint that the thread must pick up.
+import json
+import os
+import re
+import socket
+import threading
+
+import _bench
+
+done = threading.Event()
+
+
+def tick(i):
+    return i + 1
+
+
+def target():
+    import pdbp
+    pdbp.DefaultConfig.dap_port = 0
+
+    def work(n):
+        data = {"k": [1, 2, 3], "s": "x"}
+        pdbp.set_trace()
+        total = n * 2
+        return total + len(data)
+
+    def run():
+        print("result", work(10), flush=True)
+        i = 0
+        while not done.is_set():
+            i = tick(i)
+
+    t = threading.Thread(target=run)
+    t.start()
+    t.join()
+
+
+class Client:
+    def __init__(self, host, port):
+        self.sock = socket.create_connection((host, port))
+        self.f = self.sock.makefile("rb")
+        self.seq = 0
+        self.events = []
+
+    def read(self):
+        size = None
+        while True:
+            line = self.f.readline().strip()
+            if not line:
+                break
+            size = int(line.split(b":")[1])
+        return json.loads(self.f.read(size))
+
+    def request(self, command, success=True, **arguments):
+        self.seq += 1
+        data = json.dumps({
+            "seq": self.seq, "type": "request",
+            "command": command, "arguments": arguments,
+        }).encode()
+        self.sock.sendall(b"Content-Length: %d\r\n\r\n" % len(data) + data)
+        while True:
+            msg = self.read()
+            if msg["type"] == "response" and msg["request_seq"] == self.seq:
+                assert msg["success"] == success, msg
+                return msg.get("body", {})
+            self.events.append(msg)
+
+    def wait_event(self, name):
+        for msg in self.events:
+            if msg.get("event") == name:
+                self.events.remove(msg)
+                return msg["body"]
+        while True:
+            msg = self.read()
+            if msg.get("event") == name:
+                return msg["body"]
+            self.events.append(msg)
+
+
+def top_frame(client, thread_id):
+    frames = client.request("stackTrace", threadId=thread_id)["stackFrames"]
+    names = [frame["name"] for frame in frames]
+    assert "_new_thread_run" not in names, names
+    return frames[0]
+
+
+def main():
+    proc = _bench.spawn_target(__file__)
+    try:
+        line = proc.stdout.readline().decode()
+        host, port = re.search(r"DAP on (.*):(\d+)", line).groups()
+        client = Client(host, int(port))
+        client.request("initialize", adapterID="pdbp")
+        client.request("configurationDone")
+
+        threads = client.request("threads")["threads"]
+        assert len(threads) == 1, threads
+        thread_id = threads[0]["id"]
+
+        frame = top_frame(client, thread_id)
+        assert frame["name"] == "work", frame
+        scopes = client.request("scopes", frameId=frame["id"])["scopes"]
+        assert [scope["name"] for scope in scopes] == ["Locals", "Globals"]
+        variables = client.request(
+            "variables", variablesReference=scopes[0]["variablesReference"]
+        )["variables"]
+        data = {v["name"]: v for v in variables}["data"]
+        assert data["type"] == "dict" and data["variablesReference"], data
+        children = client.request(
+            "variables", variablesReference=data["variablesReference"]
+        )["variables"]
+        assert {v["name"] for v in children} >= {"'k'", "'s'"}, children
+
+        result = client.request(
+            "evaluate", frameId=frame["id"], expression="data['k'][1] * n"
+        )
+        assert result["result"] == "20", result
+
+        # Drop the events of the first stop
+        client.events.clear()
+        client.request("next", threadId=thread_id)
+        assert client.wait_event("stopped")["reason"] == "step"
+        assert top_frame(client, thread_id)["line"] == frame["line"] + 1
+
+        output = [
+            m["body"]["output"] for m in client.events
+            if m.get("event") == "output"
+        ]
+        assert output and not any("\x1b" in text for text in output), output
+
+        client.request("continue", threadId=thread_id)
+        # A running thread cannot evaluate
+        client.request(
+            "evaluate", False, frameId=frame["id"], expression="n"
+        )
+        source = {"path": os.path.abspath(__file__)}
+        line = tick.__code__.co_firstlineno + 1
+        breakpoint = client.request(
+            "setBreakpoints", source=source, breakpoints=[{"line": line}]
+        )["breakpoints"][0]
+        assert not breakpoint["verified"], breakpoint
+        changed = client.wait_event("breakpoint")["breakpoint"]
+        assert changed["id"] == breakpoint["id"] and changed["verified"]
+        assert client.wait_event("stopped")["reason"] == "breakpoint"
+        frame = top_frame(client, thread_id)
+        assert (frame["name"], frame["line"]) == ("tick", line), frame
+
+        client.request("setBreakpoints", source=source, breakpoints=[])
+        client.request(
+            "evaluate", frameId=frame["id"], expression="done.set()"
+        )
+        client.request("continue", threadId=thread_id)
+        out, _ = proc.communicate(timeout=10)
+        assert b"result 22" in out, out
+        print("ok")
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+if __name__ == "__main__":
+    if _bench.is_target():
+        target()
+    else:
+        main()
@@ -0,0 +1,96 @@
+import pdbp
+
+
+def _never(obj, old, new):
+    return False
+
+
+def test_inherited_property_keeps_its_setter():
+    class Base:
+        def __init__(self):
+            self._x = 0
+
+        @property
+        def x(self):
+            return self._x
+
+        @x.setter
+        def x(self, value):
+            self._x = value * 10
+
+    class Sub(Base):
+        pass
+
+    seen = []
+    num = pdbp.watch_attr(
+        Sub, "x", lambda obj, old, new: seen.append((old, new))
+    )
+    s = Sub()
+    s.x = 2
+    assert s._x == 20
+    assert "x" not in s.__dict__
+    assert seen == [(0, 2)]
+    pdbp.unwatch(num)
+    assert "x" not in Sub.__dict__
+    assert s.x == 20
+
+
+def test_inherited_slot_keeps_working():
+    class A:
+        __slots__ = ("y",)
+
+    class B(A):
+        __slots__ = ()
+
+    num = pdbp.watch_attr(B, "y", _never)
+    b = B()
+    b.y = 1
+    assert b.y == 1
+    del b.y
+    pdbp.unwatch(num)
+    b.y = 3
+    assert b.y == 3
+
+
+def test_instance_attribute_and_unwatch_restores_class():
+    class C:
+        y = "default"
+
+    c = C()
+    num = pdbp.watch_attr(c, "y", _never)
+    assert c.y == "default"
+    c.y = 5
+    assert c.__dict__["y"] == 5
+    pdbp.unwatch(num)
+    assert C.__dict__["y"] == "default"
+    assert c.y == 5
+
+
+def test_break_on_setattr_stops_in_the_given_pdb_class(monkeypatch):
+    monkeypatch.setenv("_PDB_DISABLE_PTY", "1")
+    stops = []
+
+    class RecordingPdb(pdbp.Pdb):
+        def interaction(self, frame, traceback):
+            stops.append((type(self), frame.f_code.co_name))
+            self.set_continue()
+
+    @pdbp.break_on_setattr("z", Pdb=RecordingPdb)
+    class D:
+        pass
+
+    def writer():
+        d = D()
+        d.z = 1
+        return d
+
+    assert pdbp.GLOBAL_PDB is None
+    try:
+        writer()
+    finally:
+        pdb = pdbp.GLOBAL_PDB
+        pdbp._thread_list.remove(pdb._thread_id)
+        pdbp.cleanup()
+        pdbp.unwatch(max(pdbp._watches))
+    assert isinstance(pdb, RecordingPdb)
+    assert stops == [(RecordingPdb, "writer")]